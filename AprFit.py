@@ -2,6 +2,12 @@ class AprFit:
     '''
     Estimate and store an exponential curve of the for y = y_0 * (1 + R) ^ (t - t_0)
 
+    The curve passes through one of the data points, (t_0, y_0), chosen to minimize the standard deviation of the fit.
+    In "coarse" mode the last point and 16 evenly spaced points are tried. In "exhaustive" mode every point is a
+    candidate: the rates through all of them come from closed-form sums, their standard deviations are estimated
+    from smooth interpolants, and only the candidates which could be the best are evaluated exactly, along with the
+    points coarse mode tries.
+
     Members:
         rate:  The effective increase in y per unit of time t (APR if t is in units of years)
         t_0:   The basis time. Adjusted to reduce standard deviation of the fit.
@@ -10,61 +16,278 @@ class AprFit:
     '''
 
     import datetime
+    import Instrumentation
     rate:  float
     t_0:   float
     y_0:   float
     stdev: float
     
-    def __init__(self, t: list, y: list):
+    MODES = ('coarse', 'exhaustive')
+
+    @Instrumentation.timed("AprFit")
+    def __init__(self, t: list, y: list, mode='coarse'):
+        if mode not in AprFit.MODES:
+            raise ValueError(f"mode must be one of {AprFit.MODES}")
         if len(t) != len(y):
             raise Exception("t and y lists must be the same length.")
         if len(t) == 0:
             raise Exception("No data in range")
 
         import math
+        import numpy
+
+        t = numpy.asarray(t, dtype=numpy.float64)
+        y = numpy.asarray(y, dtype=numpy.float64)
 
-        def calculate_rate_and_stdev(t_0:float, y_0:float):
-            # Calculate the rate by least-squares method
-            sum_dtlny      = 0.
-            sum_dt         = 0.
-            sum_dt_squared = 0.
-            skipped_lines  = 0
-            for index in range(len(t)):
-                if not float(y[index]):
-                    # Some bad data from yFinance needs to be filtered
-                    skipped_lines += 1
-                    continue
-                sum_dtlny      += (t[index] - t_0) * math.log(y[index])
-                sum_dt         += (t[index] - t_0)
-                sum_dt_squared += (t[index] - t_0) * (t[index] - t_0)
-            rate = math.exp((sum_dtlny - math.log(y_0) * sum_dt) / sum_dt_squared) - 1.
-
-            # Measure the standard deviation of this fit to the provided data
-            stdev = 0.
-            for index in range(len(t)):
-                stdev += ((y_0 * (1 + rate) ** (t[index] - t_0) - y[index]) ** 2) / (y[index] ** 2)
-            stdev /= len(t) - skipped_lines - 1.
-            stdev = math.sqrt(stdev)
-
-            return rate, stdev
-
-        best_zero_index       = len(t) - 1
-        best_rate, best_stdev = calculate_rate_and_stdev(t_0=t[best_zero_index], y_0=y[best_zero_index])
+        # Some bad data from yFinance needs to be filtered
+        valid = y != 0.
+        if numpy.any(y[valid] < 0.):
+            raise ValueError("math domain error")
+        t_valid = t[valid]
+        y_valid = y[valid]
+        # math.log rather than numpy.log so the fit matches the scalar calculation bit for bit
+        log_y = numpy.fromiter(map(math.log, y_valid.tolist()), dtype=numpy.float64, count=len(y_valid))
 
+        # Try the last point, then 16 evenly spaced points, as the basis of the curve
         number_of_steps = 16
-        for step in range(number_of_steps):
-            tmp_index = int(len(t) * step / number_of_steps)
-            tmp_rate, tmp_stdev = calculate_rate_and_stdev(t_0=t[tmp_index], y_0=y[tmp_index])
-            if tmp_stdev < best_stdev:
-                best_zero_index = tmp_index
-                best_rate       = tmp_rate
-                best_stdev      = tmp_stdev
-
-        self.rate  = best_rate
-        self.t_0   = t[best_zero_index]
-        self.y_0   = y[best_zero_index]
-        self.stdev = best_stdev
+        anchors = [len(t) - 1] + [int(len(t) * step / number_of_steps) for step in range(number_of_steps)]
+        anchors = [anchor for anchor in anchors if valid[anchor]]
+        if mode == 'exhaustive':
+            # The coarse points are kept too, so an exhaustive fit is never worse than a coarse one
+            screened = numpy.flatnonzero(valid)[AprFit.screen_anchors(t_valid, log_y)]
+            anchors = numpy.union1d(screened, numpy.array(anchors, dtype=numpy.int64)).tolist()
+        if len(anchors) == 0:
+            raise ValueError("No valid data in range")
+        rates, stdevs = AprFit.calculate_rates_and_stdevs(t_valid, y_valid, log_y, t[anchors], y[anchors])
+
+        best = 0
+        for candidate in range(1, len(anchors)):
+            if stdevs[candidate] < stdevs[best]:
+                best = candidate
+
+        self.rate  = rates[best]
+        self.t_0   = float(t[anchors[best]])
+        self.y_0   = float(y[anchors[best]])
+        self.stdev = stdevs[best]
+
+    BATCH_ROWS        = 64
+    SCREEN_NODES      = 32
+    SCREEN_MAX_NODES  = 256
+    SCREEN_TOLERANCE  = 1e-11
+    SCREEN_CANDIDATES = 8
+    SCREEN_MAX_CANDIDATES = 64
+
+    @staticmethod
+    @Instrumentation.timed("AprFit.screen_anchors")
+    def screen_anchors(t, log_y):
+        '''
+        Find the data points which could be the best basis for the curve, in linear time.
+
+        For a basis point a, the least-squares growth g = ln(1 + rate) only needs the sums of t, t^2, t ln(y) and
+        ln(y), so the rates through every point come from four sums. The squared relative error of the fit through a
+        is
+
+            sum_i (exp(c_a + g_a t_i - ln y_i) - 1)^2 = exp(2 c_a) R(g_a) - 2 exp(c_a) Q(g_a) + n
+
+        where c_a = ln y_a - g_a t_a, Q(g) = sum_i exp(g t_i - ln y_i) and R(g) = sum_i exp(2 g t_i - 2 ln y_i). log Q
+        and log R are smooth in g, so they are sampled at Chebyshev nodes spanning the rates of all points and
+        interpolated. Nodes are doubled until the interpolants converge. Every point whose estimated error could be
+        the smallest, given the interpolation error, is returned for exact evaluation.
+
+        On a flat or nearly flat series the estimates of many points tie to within the interpolation error, and
+        evaluating all of them exactly would take quadratic time. At most SCREEN_MAX_CANDIDATES points, those with
+        the smallest estimates, are returned then. The points left out are within the error of the screen of the
+        ones returned.
+
+        Parameters:
+            t: numpy array of the times of the data, without the rows that were filtered out.
+            log_y: numpy array of the natural log of the values at those times.
+
+        Returns:
+            numpy array of the indices of the candidate points, in ascending order.
+        '''
+        import numpy
+        from numpy.polynomial import chebyshev
+        n = len(t)
+        if n < 3:
+            return numpy.arange(n)
+        # Centering t keeps the sums well conditioned
+        u = t - numpy.mean(t)
+        sum_u  = numpy.sum(u)
+        sum_uu = numpy.sum(u * u)
+        sum_ul = numpy.sum(u * log_y)
+        sum_l  = numpy.sum(log_y)
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            growth = ((sum_ul - u * sum_l) - log_y * (sum_u - n * u)) / (sum_uu - 2. * u * sum_u + n * u * u)
+            offset = log_y - growth * u
+            usable = numpy.isfinite(growth)
+            if not numpy.any(usable):
+                # Every fit is undefined (NaN in the data), so there is nothing to choose between
+                return numpy.array([n - 1])
+            low  = float(numpy.min(growth[usable]))
+            high = float(numpy.max(growth[usable]))
+
+            def log_sums(g):
+                # log Q and log R at each growth in g, without overflowing
+                exponents = g[:, numpy.newaxis] * u - log_y
+                peak = numpy.max(exponents, axis=1, keepdims=True)
+                scaled = numpy.exp(exponents - peak)
+                log_q = peak[:, 0] + numpy.log(numpy.sum(scaled, axis=1))
+                log_r = 2. * peak[:, 0] + numpy.log(numpy.sum(scaled * scaled, axis=1))
+                return log_q, log_r
+
+            if high - low <= 1e-12 * max(1., abs(high)):
+                log_q, log_r = log_sums(numpy.array([low]))
+                log_q = numpy.full(n, log_q[0])
+                log_r = numpy.full(n, log_r[0])
+                error = numpy.zeros(n)
+            else:
+                x = numpy.where(usable, (2. * growth - low - high) / (high - low), 0.)
+                nodes = AprFit.SCREEN_NODES
+                while True:
+                    angles = numpy.pi * (numpy.arange(nodes) + .5) / nodes
+                    points = numpy.cos(angles)
+                    # Interpolate through the nodes with a discrete cosine transform
+                    transform = numpy.cos(numpy.outer(numpy.arange(nodes), angles)) * (2. / nodes)
+                    transform[0] /= 2.
+                    coefficients = transform @ numpy.stack(log_sums(low + (points + 1.) * (high - low) / 2.), axis=1)
+                    # The last coefficients bound the interpolation error of a converged series
+                    tail = float(numpy.max(numpy.abs(coefficients[-4:])))
+                    if not tail > AprFit.SCREEN_TOLERANCE or nodes >= AprFit.SCREEN_MAX_NODES:
+                        break
+                    nodes *= 2
+                log_q, log_r = chebyshev.chebval(x, coefficients)
+                error = numpy.full(n, 4. * tail + 1e-13 * nodes)
+
+            squared = numpy.exp(2. * offset + log_r)
+            linear  = numpy.exp(offset + log_q)
+            estimate = squared - 2. * linear + n
+            margin   = (squared + 2. * linear) * numpy.expm1(error) + 1e-12 * (squared + 2. * linear + n)
+            estimate = numpy.where(usable & numpy.isfinite(estimate), estimate, numpy.inf)
+            margin   = numpy.where(numpy.isfinite(margin), margin, numpy.inf)
+
+        # Points which could beat the best upper bound, plus a few of the best estimates regardless
+        candidates = numpy.flatnonzero(estimate - margin <= numpy.min(estimate + margin))
+        if len(candidates) > AprFit.SCREEN_MAX_CANDIDATES:
+            # The screen cannot tell these points apart, so keep the linear bound on the exact evaluation
+            order = numpy.argsort(estimate[candidates], kind='stable')
+            candidates = candidates[order[:AprFit.SCREEN_MAX_CANDIDATES]]
+        best = numpy.argpartition(estimate, AprFit.SCREEN_CANDIDATES)[:AprFit.SCREEN_CANDIDATES] \
+               if n > AprFit.SCREEN_CANDIDATES else numpy.arange(n)
+        return numpy.union1d(candidates, best)
+
+    @staticmethod
+    def _ordered_sum(terms):
+        '''
+        The sum of each column of a 2D array, adding the rows in order.
+
+        Reducing over the rows of a C-ordered array adds one row at a time, unlike numpy's pairwise sum along a
+        contiguous axis. A single column is contiguous, so it falls back to a running sum.
+        '''
+        import numpy
+        terms = numpy.ascontiguousarray(terms)
+        if terms.shape[1] == 1:
+            return numpy.cumsum(terms, axis=0)[-1]
+        return numpy.add.reduce(terms, axis=0)
+
+    @staticmethod
+    def calculate_rates_and_stdevs(t, y, log_y, t_0, y_0):
+        '''
+        Fit the rate of a curve through each of several basis points at once, and measure how well each one fits.
+
+        Every basis point is one column of a 2D array computation. Reducing over the rows adds each column up in
+        order, one row at a time, so the results match adding up the terms one at a time.
+
+        Parameters:
+            t: numpy array of the times of the data, without the rows that were filtered out.
+            y: numpy array of the values of the data at those times.
+            log_y: numpy array of the natural log of y.
+            t_0: numpy array of the basis times to try.
+            y_0: numpy array of the values at those basis times.
 
+        Returns:
+            Tuple: (list of rates, list of relative standard deviations), one of each per basis point.
+        '''
+        import math
+        import numpy
+        if len(t_0) > AprFit.BATCH_ROWS:
+            # Bound the memory of the 2D arrays
+            rates, stdevs = [], []
+            for start in range(0, len(t_0), AprFit.BATCH_ROWS):
+                stop = start + AprFit.BATCH_ROWS
+                batch_rates, batch_stdevs = AprFit.calculate_rates_and_stdevs(t, y, log_y,
+                                                                              t_0[start:stop], y_0[start:stop])
+                rates  += batch_rates
+                stdevs += batch_stdevs
+            return rates, stdevs
+        import Instrumentation
+        Instrumentation.count("fit evaluations", len(t_0))
+        Instrumentation.count("fit point evaluations", len(t_0) * len(t))
+        dt = t[:, numpy.newaxis] - t_0
+
+        # Calculate the rates by least-squares method
+        sum_dtlny      = AprFit._ordered_sum(dt * log_y[:, numpy.newaxis]).tolist()
+        sum_dt         = AprFit._ordered_sum(dt).tolist()
+        sum_dt_squared = AprFit._ordered_sum(dt * dt).tolist()
+        rates = [math.exp((sum_dtlny[k] - math.log(y_0[k]) * sum_dt[k]) / sum_dt_squared[k]) - 1.
+                 for k in range(len(t_0))]
+
+        # Measure the standard deviation of each fit to the provided data
+        if len(t) < 2:
+            raise ZeroDivisionError("float division by zero")
+        with numpy.errstate(over='raise'):
+            try:
+                growth = numpy.power(1. + numpy.array(rates), dt)
+                errors = (y_0 * growth - y[:, numpy.newaxis]) ** 2 / (y * y)[:, numpy.newaxis]
+            except(FloatingPointError):
+                raise OverflowError("Numerical result out of range")
+        stdevs = AprFit._ordered_sum(errors) / (len(t) - 1.)
+        return rates, numpy.sqrt(stdevs).tolist()
+
+    @staticmethod
+    @Instrumentation.timed("AprFit.fit_many")
+    def fit_many(t, y, offsets=None, mode='coarse'):
+        '''
+        Fit a curve to each of many series, one AprFit per series.
+
+        Each fit is already one array computation over its basis points, so the series are fitted in a loop: padding
+        series into shared matrices only saves the per-call overhead, which matters for series of a few dozen rows,
+        and is slower for the years of daily rows the screener fits. The fit and error of each series are exactly
+        those of AprFit(t, y, mode) on that series alone.
+
+        Parameters:
+            t: Flat sequence of the times of every series, one series after another. Or, when offsets is None, a list
+               with one sequence of times per series.
+            y: The values at those times, in the same layout as t.
+            offsets: Where each series starts in t and y, followed by the end of the last series, so series i is
+                     t[offsets[i]:offsets[i + 1]].
+            mode ("coarse" or "exhaustive"): How the basis point of each curve is searched for.
+
+        Returns:
+            AprFitBatch with one fit per series.
+        '''
+        import numpy
+        if mode not in AprFit.MODES:
+            raise ValueError(f"mode must be one of {AprFit.MODES}")
+        if len(t) != len(y):
+            raise Exception("t and y lists must be the same length.")
+        if offsets is None:
+            if any(len(times) != len(values) for times, values in zip(t, y)):
+                raise Exception("t and y lists must be the same length.")
+            series = list(zip(t, y))
+        else:
+            t = numpy.asarray(t, dtype=numpy.float64)
+            y = numpy.asarray(y, dtype=numpy.float64)
+            series = [(t[start:stop], y[start:stop]) for start, stop in zip(offsets[:-1], offsets[1:])]
+        batch = AprFitBatch(len(series))
+        for index, (times, values) in enumerate(series):
+            try:
+                batch.set(index, AprFit(times, values, mode=mode))
+            except Exception as ex:
+                batch.errors[index] = ex
+        return batch
+
+    @Instrumentation.timed("AprFit.plot")
     def plot(self, t:list, y:list):
         import matplotlib.pyplot as plt
         assert(len(t) == len(y))
@@ -73,4 +296,51 @@ class AprFit:
         for t_i in t:
             fit_y.append(self.y_0 * (1 + self.rate) ** (t_i - self.t_0))
         plt.plot(t, fit_y)
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+
+class AprFitBatch:
+    '''
+    The fits of many series, as returned by AprFit.fit_many.
+
+    Members:
+        rate:   (numpy array) The rate of each fit. NaN where the fit failed.
+        t_0:    (numpy array) The basis time of each fit.
+        y_0:    (numpy array) The value at the basis time of each fit.
+        stdev:  (numpy array) The relative uncertainty of each fit.
+        errors: (list) The exception raised while fitting each series, or None if the fit succeeded.
+    '''
+
+    def __init__(self, count):
+        import numpy
+        self.rate   = numpy.full(count, numpy.nan)
+        self.t_0    = numpy.full(count, numpy.nan)
+        self.y_0    = numpy.full(count, numpy.nan)
+        self.stdev  = numpy.full(count, numpy.nan)
+        self.errors = [None] * count
+
+    def __len__(self):
+        return len(self.rate)
+
+    def set(self, index, fit):
+        '''Store an AprFit as the fit of one series.'''
+        self.rate[index]  = fit.rate
+        self.t_0[index]   = fit.t_0
+        self.y_0[index]   = fit.y_0
+        self.stdev[index] = fit.stdev
+
+    def fit(self, index):
+        '''
+        The fit of one series as an AprFit.
+
+        Raises:
+            The exception raised while fitting the series, if it could not be fitted.
+        '''
+        if self.errors[index] is not None:
+            raise self.errors[index]
+        fit = AprFit.__new__(AprFit)
+        fit.rate  = float(self.rate[index])
+        fit.t_0   = float(self.t_0[index])
+        fit.y_0   = float(self.y_0[index])
+        fit.stdev = float(self.stdev[index])
+        return fit
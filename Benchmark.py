@@ -0,0 +1,820 @@
+'''
+Benchmarks for this project, run against the histories in Cache/ and against synthetic histories.
+
+The suite times parsing and saving CSV files, the Update ingest loop against a FakeProvider, AprFit, the metric
+methods of Stock and a full universe screen. Synthetic histories are scaled up in rows, to show how one history
+scales, and in symbols, to show how a universe scales. Every run is saved as a JSON report in BenchmarkReports/,
+and can be compared against an earlier report to catch regressions. The vectorized AprFit is also checked against
+the original scalar implementation, exhaustive mode is checked to stay fast on flat series, appending to a CSV file is
+checked to match rewriting it, incremental updates are checked to match full ones, and histories parsed from a window
+of their CSV file are checked to match whole ones.
+
+    python Benchmark.py [--symbols SYMBOL ...] [--full] [--compare BenchmarkReports/<earlier report>.json]
+'''
+
+class ReferenceAprFit:
+    '''
+    The original scalar implementation of AprFit, one Python loop per basis point, kept to check and time the
+    vectorized implementation against.
+
+    Members:
+        rate:  The effective increase in y per unit of time t (APR if t is in units of years)
+        t_0:   The basis time. Adjusted to reduce standard deviation of the fit.
+        y_0:   The value of at t_0
+        stdev: The relative uncertainty of estimates provided by the fit curve
+    '''
+
+    def __init__(self, t: list, y: list):
+        if len(t) != len(y):
+            raise Exception("t and y lists must be the same length.")
+        if len(t) == 0:
+            raise Exception("No data in range")
+
+        import math
+
+        def calculate_rate_and_stdev(t_0:float, y_0:float):
+            # Calculate the rate by least-squares method
+            sum_dtlny      = 0.
+            sum_dt         = 0.
+            sum_dt_squared = 0.
+            skipped_lines  = 0
+            for index in range(len(t)):
+                if not float(y[index]):
+                    # Some bad data from yFinance needs to be filtered
+                    skipped_lines += 1
+                    continue
+                sum_dtlny      += (t[index] - t_0) * math.log(y[index])
+                sum_dt         += (t[index] - t_0)
+                sum_dt_squared += (t[index] - t_0) * (t[index] - t_0)
+            rate = math.exp((sum_dtlny - math.log(y_0) * sum_dt) / sum_dt_squared) - 1.
+
+            # Measure the standard deviation of this fit to the provided data
+            stdev = 0.
+            for index in range(len(t)):
+                stdev += ((y_0 * (1 + rate) ** (t[index] - t_0) - y[index]) ** 2) / (y[index] ** 2)
+            stdev /= len(t) - skipped_lines - 1.
+            stdev = math.sqrt(stdev)
+
+            return rate, stdev
+
+        best_zero_index       = len(t) - 1
+        best_rate, best_stdev = calculate_rate_and_stdev(t_0=t[best_zero_index], y_0=y[best_zero_index])
+
+        number_of_steps = 16
+        for step in range(number_of_steps):
+            tmp_index = int(len(t) * step / number_of_steps)
+            tmp_rate, tmp_stdev = calculate_rate_and_stdev(t_0=t[tmp_index], y_0=y[tmp_index])
+            if tmp_stdev < best_stdev:
+                best_zero_index = tmp_index
+                best_rate       = tmp_rate
+                best_stdev      = tmp_stdev
+
+        self.rate  = best_rate
+        self.t_0   = t[best_zero_index]
+        self.y_0   = y[best_zero_index]
+        self.stdev = best_stdev
+
+
+def fit_inputs(stock, years):
+    '''The t and y lists which Stock.get_apr_fit passes to AprFit, relative to the latest Snapshot of the Stock.'''
+    import numpy
+    history = stock.history
+    start = stock.window(years, as_of=history[-1].date).start
+    microseconds = (history.dates[start:] - history.dates[-1]).astype(numpy.int64)
+    t = (microseconds / 1e6 / 31557600.).tolist()
+    y = (history.prices[start:] + numpy.cumsum(history.dividends[start:])).tolist()
+    return t, y
+
+
+def same_float(a, b):
+    '''Whether two floats are identical, counting NaN as identical to NaN.'''
+    import math
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+def time_call(function, repeat=3):
+    '''The best wall-clock time of several calls to function, in seconds, and the result of the last call.'''
+    import time
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best, result
+
+
+def benchmark_apr_fit(stocks, years=(3, 10, 30)):
+    '''
+    Time the vectorized AprFit against ReferenceAprFit on the histories of the given Stocks, and compare their fits.
+
+    Parameters:
+        stocks ([Stock]): The Stocks to fit.
+        years: The windows to fit over, in years.
+
+    Returns:
+        Tuple: (seconds for the reference fits, seconds for the vectorized fits, the largest relative difference in
+        stdev, and the number of fits whose rate, t_0 or y_0 differ).
+    '''
+    import AprFit
+    reference_time  = 0.
+    vectorized_time = 0.
+    worst    = 0.
+    mismatch = 0
+    for stock in stocks:
+        for window in years:
+            t, y = fit_inputs(stock, window)
+            try:
+                elapsed, expected = time_call(lambda: ReferenceAprFit(t, y), repeat=1)
+                reference_time += elapsed
+            except Exception as ex:
+                expected = ex
+            try:
+                elapsed, actual = time_call(lambda: AprFit.AprFit(t, y))
+                vectorized_time += elapsed
+            except Exception as ex:
+                actual = ex
+            if isinstance(expected, Exception) or isinstance(actual, Exception):
+                if type(expected) != type(actual):
+                    print(f"{stock.symbol} {window} years: reference gave {expected!r}, vectorized gave {actual!r}")
+                continue
+            pairs = ((expected.rate, actual.rate), (expected.t_0, actual.t_0), (expected.y_0, actual.y_0))
+            if not all(same_float(a, b) for a, b in pairs):
+                mismatch += 1
+                print(f"{stock.symbol} {window} years: fits differ ({expected.rate}, {expected.t_0}) != ({actual.rate}, {actual.t_0})")
+            if expected.stdev != 0. and not same_float(expected.stdev, actual.stdev):
+                worst = max(worst, abs(actual.stdev - expected.stdev) / expected.stdev)
+    return reference_time, vectorized_time, worst, mismatch
+
+
+def compare_apr_fit_modes(stocks, years=(3, 10, 30)):
+    '''
+    Time the coarse and exhaustive modes of AprFit on the histories of the given Stocks, and compare their fits.
+
+    Returns:
+        Tuple: (seconds for the coarse fits, seconds for the exhaustive fits, the number of fits, and the number of
+        fits where exhaustive mode found a smaller stdev).
+    '''
+    import AprFit
+    coarse_time     = 0.
+    exhaustive_time = 0.
+    fits     = 0
+    improved = 0
+    for stock in stocks:
+        for window in years:
+            t, y = fit_inputs(stock, window)
+            try:
+                elapsed, coarse = time_call(lambda: AprFit.AprFit(t, y, mode='coarse'))
+                coarse_time += elapsed
+                elapsed, exhaustive = time_call(lambda: AprFit.AprFit(t, y, mode='exhaustive'))
+                exhaustive_time += elapsed
+            except Exception:
+                continue
+            fits += 1
+            if exhaustive.stdev < coarse.stdev:
+                improved += 1
+            elif exhaustive.stdev > coarse.stdev:
+                print(f"{stock.symbol} {window} years: exhaustive fit is worse than coarse ({exhaustive.stdev} > {coarse.stdev})")
+    return coarse_time, exhaustive_time, fits, improved
+
+
+def check_flat_series(rows=(5000, 20000), limit=1.):
+    '''
+    Check that exhaustive AprFit stays fast on constant and nearly flat series, such as stablecoins and money market
+    funds, where the estimates of every basis point tie, and that it is never worse than coarse mode on them.
+
+    Parameters:
+        rows: The lengths of the series to fit.
+        limit: The most seconds one exhaustive fit may take.
+
+    Returns:
+        The number of series which failed the check.
+    '''
+    import time
+    import numpy
+    import AprFit
+    failures = 0
+    for count in rows:
+        t = numpy.linspace(-10., 0., count)
+        noise = 1e-9 * numpy.sin(numpy.arange(count) * 12.9898)
+        for name, y in (("constant", numpy.ones(count)), ("nearly flat", 1. + noise)):
+            start = time.perf_counter()
+            exhaustive = AprFit.AprFit(t, y, mode='exhaustive')
+            elapsed = time.perf_counter() - start
+            coarse = AprFit.AprFit(t, y)
+            if elapsed > limit or exhaustive.stdev > coarse.stdev:
+                failures += 1
+                print(f"FAILED: exhaustive AprFit on a {name} series of {count} rows took {elapsed:.3f}s, "
+                      f"stdev {exhaustive.stdev} against {coarse.stdev} coarse")
+    return failures
+
+
+def truncated_copy(stock, keep):
+    '''A copy of a Stock with only the first keep rows of its history, and the same header fields.'''
+    from History import History
+    from Stocks import Stock
+    history = stock.history
+    older = Stock(symbol=stock.symbol, name=stock.name, market=stock.market,
+                  history=History(history.dates[:keep], history.prices[:keep], history.dividends[:keep],
+                                  history.annualDividends[:keep]))
+    older.pe_ratio = stock._pe_ratio
+    older.short_percent_of_float = stock._short_percent_of_float
+    return older
+
+
+def same_columns(a, b):
+    '''Whether two Histories hold identical rows, counting NaN as identical to NaN.'''
+    import numpy
+    return len(a) == len(b) and numpy.array_equal(a.dates, b.dates) and \
+           all(numpy.array_equal(x, y, equal_nan=True) for x, y in ((a.prices, b.prices), (a.dividends, b.dividends),
+                                                                   (a.annualDividends, b.annualDividends)))
+
+
+def check_csv_append(stocks, new_rows=(1, 5, 60)):
+    '''
+    Check that SaveToCSV appending new rows writes the same bytes as rewriting the whole file, and that a changed
+    header or a file changed behind the cache manifest's back makes it rewrite instead. Runs in a scratch cache.
+
+    Parameters:
+        stocks ([Stock]): The Stocks whose histories to save.
+        new_rows: How many rows to append, each tried on every Stock.
+
+    Returns:
+        The number of checks which failed.
+    '''
+    import datetime, math, os
+    failures = 0
+    def contents(path):
+        with open(path, 'rb') as file:
+            return file.read()
+    def fail(message):
+        nonlocal failures
+        failures += 1
+        print(f"FAILED: {message}")
+    with scratch_cache():
+        for stock in stocks:
+            path = f"Cache/{stock.symbol}.csv"
+            history = stock.history
+            for count in new_rows:
+                keep = len(history) - count
+                if keep < 1:
+                    continue
+                older = truncated_copy(stock, keep)
+                quietly(lambda: older.SaveToCSV(mode='rewrite'))
+                older.AddSnapshots(dates=history.dates[keep:], prices=history.prices[keep:],
+                                   dividends=history.dividends[keep:], annualDividends=history.annualDividends[keep:])
+                try:
+                    quietly(lambda: older.SaveToCSV(mode='append'))
+                except Exception as ex:
+                    fail(f"{stock.symbol}: could not append {count} rows: {ex}")
+                    continue
+                appended = contents(path)
+                quietly(lambda: older.SaveToCSV(mode='rewrite'))
+                if appended != contents(path):
+                    fail(f"{stock.symbol}: appending {count} rows differs from rewriting the file")
+
+            # A changed header, or a file changed since the manifest recorded it, cannot be appended to
+            last = history[-1]
+            for change in ("header", "file"):
+                older = truncated_copy(stock, len(history))
+                quietly(lambda: older.SaveToCSV(mode='rewrite'))
+                older.AddSnapshot(price=last.price, date=last.date + datetime.timedelta(days=1))
+                if change == "header":
+                    older.pe_ratio = 1. if math.isinf(older.pe_ratio or 0.) else math.inf
+                else:
+                    stat = os.stat(path)
+                    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+                try:
+                    quietly(lambda: older.SaveToCSV(mode='append'))
+                    fail(f"{stock.symbol}: appended to a file with a changed {change}")
+                except Exception:
+                    pass
+                quietly(lambda: older.SaveToCSV(mode='auto'))
+                automatic = contents(path)
+                quietly(lambda: older.SaveToCSV(mode='rewrite'))
+                if automatic != contents(path):
+                    fail(f"{stock.symbol}: saving after a changed {change} did not rewrite the file")
+    return failures
+
+
+def check_incremental_update(stocks, new_rows=(1, 5, 60, 300)):
+    '''
+    Check that Stock.Update(incremental=True) on the older rows of a history ends up with exactly the rows a full
+    Update gets, annualized dividends included, served by a FakeProvider.
+
+    Parameters:
+        stocks ([Stock]): The Stocks whose histories the FakeProvider serves.
+        new_rows: How many rows to leave for the incremental update, each tried on every Stock.
+
+    Returns:
+        The number of checks which failed.
+    '''
+    from MarketData import FakeProvider
+    from Stocks import Stock
+    provider = FakeProvider.from_stocks(stocks)
+    failures = 0
+    for stock in stocks:
+        full = Stock(symbol=stock.symbol, name=stock.name)
+        quietly(lambda: full.Update(provider=provider))
+        for count in new_rows:
+            keep = len(full.history) - count
+            if keep < 1:
+                continue
+            older = truncated_copy(full, keep)
+            quietly(lambda: older.Update(provider=provider, incremental=True))
+            if not same_columns(older.history, full.history):
+                failures += 1
+                print(f"FAILED: {stock.symbol}: updating the last {count} rows incrementally differs from a full Update")
+    return failures
+
+
+def check_windowed_history(stocks, days=(150, 400), new_rows=60, lag=200):
+    '''
+    Check that a Stock parsed with ParseCSV(since=...) gets the same results as one parsed whole, where they need rows
+    from before the window: the annualized dividends of an incremental Update, and rolling_total_yield. Runs in a
+    scratch cache.
+
+    Parameters:
+        stocks ([Stock]): The Stocks whose histories to save and parse.
+        days: How many days before the latest Snapshot each window starts, each tried on every Stock.
+        new_rows: How many rows to leave for the incremental update.
+        lag: The lag of rolling_total_yield, which starts 100 days after the window.
+
+    Returns:
+        The number of checks which failed.
+    '''
+    import datetime
+    import numpy
+    from MarketData import FakeProvider
+    from Stocks import Stock
+    provider = FakeProvider.from_stocks(stocks)
+    failures = 0
+    def fail(message):
+        nonlocal failures
+        failures += 1
+        print(f"FAILED: {message}")
+    with scratch_cache():
+        for stock in stocks:
+            path = f"Cache/{stock.symbol}.csv"
+            full = Stock(symbol=stock.symbol, name=stock.name)
+            quietly(lambda: full.Update(provider=provider))
+            if len(full.history) <= new_rows:
+                continue
+            for span in days:
+                older = truncated_copy(full, len(full.history) - new_rows)
+                quietly(lambda: older.SaveToCSV(mode='rewrite'))
+                since  = older.history[-1].date - datetime.timedelta(days=span)
+                window = Stock.ParseCSV(path, since=since)
+                quietly(lambda: window.Update(provider=provider, incremental=True))
+                quietly(lambda: window.LoadFullHistory())
+                if not same_columns(window.history, full.history):
+                    fail(f"{stock.symbol}: updating a history parsed from {span} days back differs from a full Update")
+
+                quietly(lambda: full.SaveToCSV(mode='rewrite'))
+                start  = full.history[-1].date - datetime.timedelta(days=span - 100)
+                window = Stock.ParseCSV(path, since=full.history[-1].date - datetime.timedelta(days=span))
+                dates, values = quietly(lambda: window.rolling_total_yield(lag, start=start))
+                expected_dates, expected = full.rolling_total_yield(lag, start=start)
+                if not (numpy.array_equal(dates, expected_dates) and numpy.array_equal(values, expected)):
+                    fail(f"{stock.symbol}: rolling_total_yield of a history parsed from {span} days back differs")
+    return failures
+
+
+def benchmark_sweep(stocks, horizons=None):
+    '''
+    Time Stock.sweep against evaluating every Stock and horizon separately with the single-Stock methods. The
+    analytics caches of the Stocks are cleared before every run, so nothing is reused between runs.
+
+    Returns:
+        Tuple: (seconds for the separate evaluations, seconds for the sweep, the number of rows in the sweep).
+    '''
+    from Stocks import Stock
+    horizons = horizons or Stock.SWEEP_HORIZONS
+    def clear_caches():
+        for stock in stocks:
+            stock.cache_clear()
+    def evaluate_separately():
+        clear_caches()
+        for stock in stocks:
+            for years in horizons:
+                try:
+                    stock.get_apr_fit(years)
+                except Exception:
+                    pass
+                try:
+                    stock.GrowthAPRWithUncertainty(years)
+                except ArithmeticError:
+                    pass
+                stock.AverageDividendPercent(years)
+                stock.DividendPercentUncertainty(years)
+    separate_time, _ = time_call(evaluate_separately)
+    sweep_time, table = time_call(lambda: clear_caches() or Stock.sweep(stocks, horizons))
+    return separate_time, sweep_time, len(table)
+
+
+def cached_stocks(symbols=None):
+    '''
+    Parse the given symbols, or every symbol in Cache/, straight from their CSV files. Unlike Stock.LoadMany, this
+    never converts them to binary or records them in the cache manifest, so the real cache is left untouched.
+    '''
+    import os
+    from Stocks import Stock
+    if not symbols:
+        symbols = sorted(name[:-4] for name in os.listdir("Cache") if name.endswith(".csv"))
+    stocks = []
+    for symbol in symbols:
+        path = f"Cache/{symbol}.csv"
+        if os.path.exists(path):
+            stock = Stock.ParseCSV(path)
+            if len(stock.history) != 0:
+                stocks.append(stock)
+    return stocks
+
+
+REPORT_DIRECTORY = "BenchmarkReports"
+SYNTHETIC_ROWS   = (1000, 10000, 100000)
+UNIVERSE_SIZES   = (100, 1000)
+FULL_UNIVERSE_SIZES = (100, 1000, 5000)
+UNIVERSE_ROWS    = 1400
+METRIC_YEARS     = (1, 3, 10, 30)
+WINDOW_YEARS     = 5     # How much of each CSV file the windowed ParseCSV benchmark reads
+
+
+def synthetic_stock(symbol, rows, freq='B'):
+    '''A Stock holding the deterministic synthetic history MarketData.FakeProvider serves for the symbol.'''
+    from History import History
+    from MarketData import FakeProvider
+    from Stocks import Stock
+    frame = FakeProvider.synthetic_frame(symbol, rows=rows, freq=freq)
+    stock = Stock(symbol=symbol)
+    stock.AddSnapshots(dates=History.to_datetime64_array(frame.index), prices=frame['Open'].to_numpy(),
+                       dividends=frame['Dividends'].to_numpy())
+    stock.RecomputeAnnualDividends()
+    return stock
+
+
+def scratch_cache():
+    '''
+    A context manager which runs its body in an empty temporary working directory with its own Cache/, so benchmarks
+    which write to the cache never touch the real one. The shared cache manifest and derived results of the real
+    cache are set aside until the body finishes.
+    '''
+    import contextlib, os, tempfile
+    from CacheManifest import CacheManifest
+    from DerivedCache import DerivedCache
+    @contextlib.contextmanager
+    def scratch():
+        previous = os.getcwd()
+        shared   = (dict(CacheManifest._shared), dict(DerivedCache._shared))
+        with tempfile.TemporaryDirectory() as directory:
+            os.mkdir(os.path.join(directory, "Cache"))
+            CacheManifest._shared.clear()
+            DerivedCache._shared.clear()
+            os.chdir(directory)
+            try:
+                yield directory
+            finally:
+                # Write out what the scratch caches hold now, or their exit handlers would write it to the real cache
+                for cache in list(CacheManifest._shared.values()) + list(DerivedCache._shared.values()):
+                    cache.save()
+                os.chdir(previous)
+                CacheManifest._shared.clear()
+                CacheManifest._shared.update(shared[0])
+                DerivedCache._shared.clear()
+                DerivedCache._shared.update(shared[1])
+    return scratch()
+
+
+def quietly(function):
+    '''Call function with its progress messages discarded, and return its result.'''
+    import contextlib, os
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return function()
+
+
+def record(results, benchmark, corpus, size, items, seconds, rows=None):
+    '''
+    Add a timing to a report.
+
+    Parameters:
+        results ([dict]): The timings of the report.
+        benchmark: What was timed.
+        corpus ("cache" or "synthetic"): Which histories it was timed on.
+        size: The scale of the run. The number of rows for a single history, or of symbols for a universe.
+        items: How many histories the timing covers.
+        seconds: The best wall-clock time.
+        rows: How many rows were processed, for benchmarks which process whole histories.
+    '''
+    results.append({'benchmark' : benchmark, 'corpus' : corpus, 'size' : size, 'items' : items, 'seconds' : seconds,
+                    'microseconds_per_row' : 1e6 * seconds / rows if rows else None})
+
+
+def suite_csv(stocks, corpus, size, results, paths=None):
+    '''
+    Time SaveToCSV rewriting and appending, and ParseCSV of whole files and of their last WINDOW_YEARS years, on
+    copies of the given Stocks in a scratch cache, so the rows appended never reach the caller's Stocks.
+
+    Parameters:
+        paths: CSV files to time ParseCSV on in place. Defaults to the files saved in the scratch cache.
+    '''
+    import datetime
+    from Stocks import Stock
+    rows   = sum(len(stock.history) for stock in stocks)
+    stocks = [truncated_copy(stock, len(stock.history)) for stock in stocks]
+    with scratch_cache():
+        elapsed, _ = time_call(lambda: quietly(lambda: [stock.SaveToCSV(mode='rewrite') for stock in stocks]))
+        record(results, "SaveToCSV rewrite", corpus, size, len(stocks), elapsed, rows)
+        def append():
+            for stock in stocks:
+                last = stock.history[-1]
+                stock.AddSnapshot(price=last.price, date=last.date + datetime.timedelta(days=1))
+                stock.SaveToCSV(mode='append')
+        elapsed, _ = time_call(lambda: quietly(append))
+        record(results, "SaveToCSV append", corpus, size, len(stocks), elapsed)
+        files = paths or [f"Cache/{stock.symbol}.csv" for stock in stocks]
+        elapsed, _ = time_call(lambda: quietly(lambda: [Stock.ParseCSV(path) for path in files]))
+        record(results, "ParseCSV", corpus, size, len(files), elapsed, rows)
+        starts = [stock.history[-1].date - datetime.timedelta(days=365.25 * WINDOW_YEARS) for stock in stocks]
+        elapsed, _ = time_call(lambda: quietly(lambda: [Stock.ParseCSV(path, since=since) for path, since in zip(files, starts)]))
+        record(results, f"ParseCSV last {WINDOW_YEARS} years", corpus, size, len(files), elapsed)
+
+
+def suite_update(stocks, corpus, size, results, new_rows=20):
+    '''Time Stock.Update ingesting whole histories, and the last new_rows rows incrementally, from a FakeProvider.'''
+    from History import History
+    from MarketData import FakeProvider
+    from Stocks import Stock
+    provider = FakeProvider.from_stocks(stocks)
+    rows     = sum(len(stock.history) for stock in stocks)
+    def full():
+        for stock in stocks:
+            Stock(symbol=stock.symbol, name=stock.name).Update(provider=provider)
+    elapsed, _ = time_call(lambda: quietly(full))
+    record(results, "Update full", corpus, size, len(stocks), elapsed, rows)
+    def incremental():
+        for stock in stocks:
+            history = stock.history
+            keep    = max(1, len(history) - new_rows)
+            older   = Stock(symbol=stock.symbol, name=stock.name,
+                            history=History(history.dates[:keep], history.prices[:keep], history.dividends[:keep],
+                                            history.annualDividends[:keep]))
+            older.Update(provider=provider, incremental=True)
+    elapsed, _ = time_call(lambda: quietly(incremental))
+    record(results, "Update incremental", corpus, size, len(stocks), elapsed)
+
+
+def suite_apr_fit(stocks, corpus, size, results, years=(10, 30)):
+    '''Time AprFit in each mode, and AprFit.fit_many, on the given Stocks.'''
+    import AprFit
+    inputs = [fit_inputs(stock, window) for stock in stocks for window in years]
+    for mode in AprFit.AprFit.MODES:
+        def fit_all():
+            for t, y in inputs:
+                try:
+                    AprFit.AprFit(t, y, mode=mode)
+                except Exception:
+                    pass
+        elapsed, _ = time_call(fit_all)
+        record(results, f"AprFit {mode}", corpus, size, len(stocks), elapsed)
+    elapsed, _ = time_call(lambda: AprFit.AprFit.fit_many([t for t, _ in inputs], [y for _, y in inputs]))
+    record(results, "AprFit.fit_many", corpus, size, len(stocks), elapsed)
+
+
+def suite_metrics(stocks, corpus, size, results, years=METRIC_YEARS):
+    '''
+    Time each metric method of Stock over several horizons, with empty analytics caches and then with full ones, and
+    the same growth and dividend metrics computed for every Stock at once by a Universe.
+    '''
+    from Stocks import Stock
+    from Universe import Universe
+    metrics = (Stock.GrowthAPR, Stock.GrowthAPRWithUncertainty, Stock.AverageDividendPercent,
+               Stock.DividendPercentUncertainty, Stock.DividendYieldStatistics, Stock.get_apr_fit)
+    def evaluate(metric):
+        for stock in stocks:
+            for window in years:
+                try:
+                    metric(stock, window)
+                except Exception:
+                    pass
+    for metric in metrics:
+        def cold():
+            for stock in stocks:
+                stock.cache_clear()
+            evaluate(metric)
+        elapsed, _ = time_call(cold)
+        record(results, f"Stock.{metric.__name__}", corpus, size, len(stocks), elapsed)
+    elapsed, _ = time_call(lambda: [evaluate(metric) for metric in metrics])
+    record(results, "Stock metrics cached", corpus, size, len(stocks), elapsed)
+    elapsed, universe = time_call(lambda: Universe.FromStocks(stocks))
+    record(results, "Universe.FromStocks", corpus, size, len(stocks), elapsed)
+    elapsed, _ = time_call(lambda: [(universe.growth_apr(window), universe.dividend_percent(window)) for window in years])
+    record(results, "Universe metrics", corpus, size, len(stocks), elapsed)
+
+
+def suite_screen(stocks, corpus, size, results, years=10., symbols=None):
+    '''
+    Time each phase of a Screener run on the given Stocks, with empty analytics caches.
+
+    Parameters:
+        symbols ([str]): When given, also time a whole Screener.run of these symbols from the cache, load included.
+            It runs on copies of their CSV files in a scratch cache, so the binary files and manifest it writes never
+            reach the real one.
+    '''
+    import os, shutil, time
+    import Screener
+    for stock in stocks:
+        stock.cache_clear()
+    start = time.perf_counter()
+    fits  = Screener.fit(stocks, years)
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    candidates, _ = Screener.score(stocks, fits, years)
+    score_time = time.perf_counter() - start
+    start = time.perf_counter()
+    Screener.allocate(candidates)
+    allocate_time = time.perf_counter() - start
+    record(results, "Screener fit", corpus, size, len(stocks), fit_time)
+    record(results, "Screener score", corpus, size, len(stocks), score_time)
+    record(results, "Screener allocate", corpus, size, len(stocks), allocate_time)
+    if symbols is not None:
+        sources = [os.path.abspath(f"Cache/{symbol}.csv") for symbol in symbols]
+        with scratch_cache():
+            for source in sources:
+                shutil.copy(source, "Cache")
+            elapsed, _ = time_call(lambda: quietly(lambda: Screener.run(symbols, horizons=(years,), offline=True)),
+                                   repeat=1)
+        record(results, "Screener run", corpus, size, len(symbols), elapsed)
+
+
+def environment():
+    '''The versions and machine a report was made with.'''
+    import os, platform, subprocess
+    import numpy
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except(OSError):
+        commit = None
+    return {'python' : platform.python_version(), 'numpy' : numpy.__version__, 'platform' : platform.platform(),
+            'processor' : platform.processor(), 'cpus' : os.cpu_count(), 'commit' : commit}
+
+
+def save_report(results, directory=REPORT_DIRECTORY, label=None):
+    '''
+    Save timings as a JSON report.
+
+    Returns:
+        The path of the report: <directory>/<date and time>[-<label>].json
+    '''
+    import datetime, json, os
+    now  = datetime.datetime.now()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, now.strftime("%Y%m%d-%H%M%S") + (f"-{label}" if label else "") + ".json")
+    with open(path, 'w') as file:
+        json.dump({'created' : now.isoformat(), 'label' : label, 'environment' : environment(), 'results' : results},
+                  file, indent=1)
+    return path
+
+
+def print_results(results):
+    '''Print timings grouped by benchmark, so the scaling of each is visible at a glance.'''
+    for benchmark in dict.fromkeys(result['benchmark'] for result in results):
+        print(benchmark)
+        for result in results:
+            if result['benchmark'] == benchmark:
+                per_row = result['microseconds_per_row']
+                print(f"    {result['corpus']:>9} size {result['size']:>8} x{result['items']:<5} {result['seconds']:10.4f}s"
+                      + (f"  {per_row:8.3f} us/row" if per_row is not None else ""))
+
+
+def compare_reports(baseline, results, threshold=1.2, floor=0.01):
+    '''
+    Compare timings against an earlier report.
+
+    Parameters:
+        baseline (dict): The earlier report, as saved by save_report.
+        results ([dict]): The new timings.
+        threshold: How many times slower a timing may get before it counts as a regression.
+        floor: Timings shorter than this many seconds are too noisy to count as regressions.
+
+    Returns:
+        The number of regressions.
+    '''
+    earlier = {(result['benchmark'], result['corpus'], result['size']) : result['seconds'] for result in baseline['results']}
+    regressions = 0
+    print(f"Compared with the report of {baseline['created']} (commit {baseline['environment'].get('commit')}):")
+    for result in results:
+        before = earlier.get((result['benchmark'], result['corpus'], result['size']))
+        if not before or not result['seconds']:
+            continue
+        ratio = result['seconds'] / before
+        flag  = ""
+        if ratio > threshold and result['seconds'] > floor:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"    {result['benchmark']:<32} {result['corpus']:>9} size {result['size']:>8} "
+              f"{before:10.4f}s -> {result['seconds']:10.4f}s ({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def run_suite(stocks, rows=SYNTHETIC_ROWS, universes=UNIVERSE_SIZES, universe_rows=UNIVERSE_ROWS, cache=True,
+              synthetic=True):
+    '''
+    Run every benchmark on the cached Stocks and on synthetic histories.
+
+    Parameters:
+        stocks ([Stock]): The cached Stocks.
+        rows: The sizes of the single synthetic histories.
+        universes: The numbers of synthetic symbols to screen.
+        universe_rows: The number of rows of each synthetic symbol in a universe.
+        cache, synthetic: Which corpora to run on.
+
+    Returns:
+        [dict] The timings, as recorded by record().
+    '''
+    import os
+    results = []
+    if cache and stocks:
+        size  = sum(len(stock.history) for stock in stocks)
+        paths = [os.path.abspath(f"Cache/{stock.symbol}.csv") for stock in stocks]
+        suite_update(stocks, "cache", size, results)
+        suite_apr_fit(stocks, "cache", size, results)
+        suite_metrics(stocks, "cache", size, results)
+        suite_screen(stocks, "cache", size, results, symbols=[stock.symbol for stock in stocks])
+        suite_csv(stocks, "cache", size, results, paths=paths)
+    if synthetic:
+        for count in rows:
+            single = [synthetic_stock(f"SYN{count}", count, freq='D')]
+            suite_update(single, "synthetic", count, results)
+            suite_apr_fit(single, "synthetic", count, results)
+            suite_metrics(single, "synthetic", count, results)
+            suite_csv(single, "synthetic", count, results)
+        for count in universes:
+            universe = [synthetic_stock(f"SYN{index:05d}", universe_rows) for index in range(count)]
+            suite_screen(universe, "synthetic", count, results, years=5.)
+            suite_metrics(universe, "synthetic", count, results, years=(1, 5))
+    return results
+
+
+def main(argv=None):
+    '''Run the benchmark suite from the command line. Returns the number of failed checks and regressions found.'''
+    import argparse, json
+    from Stocks import Stock
+    parser = argparse.ArgumentParser(description="Benchmark this project on Cache/ and on synthetic histories.")
+    parser.add_argument('--symbols', nargs='*', default=None, help="Cached symbols to use. Defaults to all of Cache/.")
+    parser.add_argument('--rows', type=int, nargs='*', default=list(SYNTHETIC_ROWS), help="Sizes of single synthetic histories.")
+    parser.add_argument('--universes', type=int, nargs='*', default=None, help="Numbers of synthetic symbols to screen.")
+    parser.add_argument('--full', action='store_true', help=f"Screen synthetic universes of {FULL_UNIVERSE_SIZES} symbols.")
+    parser.add_argument('--skip-cache', action='store_true', help="Do not benchmark the cached histories.")
+    parser.add_argument('--skip-synthetic', action='store_true', help="Do not benchmark synthetic histories.")
+    parser.add_argument('--skip-checks', action='store_true', help="Do not run the correctness checks.")
+    parser.add_argument('--report-dir', default=REPORT_DIRECTORY, help="Where to save the report.")
+    parser.add_argument('--label', default=None, help="A name to add to the report file name.")
+    parser.add_argument('--compare', default=None, help="An earlier report to compare against.")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Slowdown which counts as a regression.")
+    args = parser.parse_args(argv)
+
+    # Time the analytics themselves rather than results saved by earlier runs
+    Stock.PERSIST_ANALYTICS = False
+    stocks = [] if args.skip_cache else quietly(lambda: cached_stocks(args.symbols))
+    failures = 0
+    if stocks and not args.skip_checks:
+        failures = check_against_reference(stocks)
+    universes = args.universes if args.universes is not None else (FULL_UNIVERSE_SIZES if args.full else UNIVERSE_SIZES)
+    results = run_suite(stocks, rows=args.rows, universes=universes, cache=not args.skip_cache,
+                        synthetic=not args.skip_synthetic)
+    print_results(results)
+    print(f"Report saved to {save_report(results, args.report_dir, args.label)}")
+    if args.compare:
+        with open(args.compare) as file:
+            failures += compare_reports(json.load(file), results, args.threshold)
+    return failures
+
+
+def check_against_reference(stocks):
+    '''
+    Check the vectorized analytics against the original implementations on the cached Stocks, and time both.
+
+    Returns:
+        The number of checks which failed.
+    '''
+    failures = check_flat_series()
+    failures += check_csv_append(stocks)
+    failures += check_incremental_update(stocks)
+    failures += check_windowed_history(stocks)
+    print(f"{failures} correctness checks failed.")
+    reference_time, vectorized_time, worst, mismatch = benchmark_apr_fit(stocks)
+    print(f"AprFit on {len(stocks)} histories: reference {reference_time:.3f}s, vectorized {vectorized_time:.3f}s "
+          f"({reference_time / vectorized_time:.1f}x faster)")
+    print(f"{mismatch} fits differ in rate, t_0 or y_0. Largest relative difference in stdev: {worst:.2e}")
+    coarse_time, exhaustive_time, fits, improved = compare_apr_fit_modes(stocks)
+    print(f"AprFit modes on {fits} fits: coarse {coarse_time:.3f}s, exhaustive {exhaustive_time:.3f}s. "
+          f"Exhaustive mode found a better fit {improved} times.")
+    separate_time, sweep_time, rows = benchmark_sweep(stocks)
+    print(f"Sweeping {rows} symbol and horizon pairs: one at a time {separate_time:.3f}s, in one sweep {sweep_time:.3f}s.")
+    return failures
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(1 if main() else 0)
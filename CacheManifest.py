@@ -0,0 +1,143 @@
+class CacheManifest:
+    '''
+    An index of the Stocks cached in Cache/, so freshness can be checked without parsing any history.
+
+    Each entry maps a symbol to the first and last cached dates, the number of rows, the size and modification time
+    of the CSV file, the P/E ratio, the short percent of float and the header rows as written to the file. An entry
+    only counts while the CSV file still has the recorded size and modification time, so files edited or replaced
+    behind the manifest's back are never trusted.
+
+    Recorded entries are kept in memory and written out by save(), which the batch loaders call once per batch and
+    which also runs at exit, so recording many symbols does not rewrite the file once per symbol. A manifest which
+    missed its last save is still safe to use: the entries it lacks are indexed again, and the ones it holds for
+    files saved since no longer match them.
+
+    Members:
+        path:    Where the manifest is stored.
+        entries: (Dict[str, dict]) The manifest entries by symbol.
+    '''
+
+    import threading
+
+    DEFAULT_PATH = "Cache/manifest.json"
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path=DEFAULT_PATH):
+        '''
+        Load the manifest at the given path, or start an empty one if it does not exist yet.
+
+        Parameters:
+            path: Where the manifest is stored.
+        '''
+        import json, threading
+        self.path    = path
+        self.entries = {}
+        self._lock   = threading.RLock()
+        self._dirty  = False
+        try:
+            with open(path) as file:
+                self.entries = json.load(file)
+        except(FileNotFoundError):
+            pass
+        except(ValueError) as ex:
+            print(f"WARNING: Ignoring unreadable cache manifest {path}: {ex}")
+
+    @staticmethod
+    def Open(path=DEFAULT_PATH):
+        '''Return the manifest at the given path, shared by every caller in this process and saved at exit.'''
+        import atexit
+        with CacheManifest._shared_lock:
+            if path not in CacheManifest._shared:
+                manifest = CacheManifest(path)
+                atexit.register(manifest.save)
+                CacheManifest._shared[path] = manifest
+            return CacheManifest._shared[path]
+
+    @staticmethod
+    def csv_path(symbol):
+        '''The path of the cached CSV file for the given symbol.'''
+        return f"Cache/{symbol}.csv"
+
+    def get(self, symbol):
+        '''
+        The manifest entry for the given symbol.
+
+        Returns:
+            The entry as a dict, or None if there is no entry or the CSV file has changed since it was recorded.
+        '''
+        import os
+        with self._lock:
+            entry = self.entries.get(symbol)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(CacheManifest.csv_path(symbol))
+        except(OSError):
+            return None
+        if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime_ns']:
+            return None
+        return entry
+
+    def last_date(self, symbol):
+        '''The date of the latest cached Snapshot of the given symbol, or None if it is not known.'''
+        import datetime
+        entry = self.get(symbol)
+        if entry is None or entry['last_date'] is None:
+            return None
+        return datetime.datetime.fromisoformat(entry['last_date'])
+
+    def is_fresh(self, symbol, minDate=None):
+        '''
+        Whether the cached history of the given symbol reaches minDate.
+
+        Parameters:
+            symbol: The symbol to check.
+            minDate (datetime): The oldest acceptable date for the latest cached Snapshot. None accepts any history.
+
+        Returns:
+            True or False, or None if the manifest does not know the symbol.
+        '''
+        entry = self.get(symbol)
+        if entry is None:
+            return None
+        if entry['rows'] == 0:
+            return False
+        return minDate == None or self.last_date(symbol) >= minDate
+
+    def record(self, stock, path=None):
+        '''
+        Record the cached state of a Stock after its CSV file has been written or parsed. The manifest is written by
+        the next save().
+
+        Parameters:
+            stock (Stock): The Stock which was cached.
+            path: The CSV file holding the Stock. Defaults to Cache/<symbol>.csv.
+        '''
+        import os
+        history = stock._history
+        stat = os.stat(path or CacheManifest.csv_path(stock.symbol))
+        entry = {'first_date'             : history[0].date.isoformat() if len(history) != 0 else None,
+                 'last_date'              : history[-1].date.isoformat() if len(history) != 0 else None,
+                 'rows'                   : len(history),
+                 'size'                   : stat.st_size,
+                 'mtime_ns'               : stat.st_mtime_ns,
+                 'pe_ratio'               : stock._pe_ratio,
+                 'short_percent_of_float' : stock._short_percent_of_float,
+                 'header'                 : stock._CSVHeader()}
+        with self._lock:
+            self.entries[stock.symbol] = entry
+            self._dirty = True
+
+    def save(self):
+        '''Write the manifest to disk, replacing the old file in one step. Does nothing if nothing was recorded.'''
+        import json, os
+        with self._lock:
+            if not self._dirty:
+                return
+            temporary = f"{self.path}.tmp"
+            with open(temporary, 'w') as file:
+                json.dump(self.entries, file, indent=1, sort_keys=True)
+            os.replace(temporary, self.path)
+            self._dirty = False
@@ -0,0 +1,138 @@
+class DerivedCache:
+    '''
+    Results derived from cached histories, such as APR fits and dividend yields, kept on disk next to the histories so
+    later sessions can reuse them instead of recomputing them.
+
+    Each symbol has its own file, Cache/<symbol>.derived.json, holding the fingerprint of the history the results
+    were derived from and the results by key. The fingerprint covers the symbol, the last date, the number of rows
+    and a hash of every column, so results are only reused for the exact history they came from. When a history
+    changes, every result stored for its symbol is dropped the next time one is stored.
+
+    Results are kept in memory until save() is called. The shared cache returned by Open() also saves itself when
+    the process exits.
+
+    Members:
+        directory: Where the files are stored.
+        hits:      The number of lookups answered from this cache.
+        misses:    The number of lookups which found nothing usable.
+    '''
+
+    import threading
+
+    DEFAULT_DIRECTORY = "Cache"
+    MAX_ENTRIES       = 256
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        import threading
+        self.directory = directory
+        self.hits      = 0
+        self.misses    = 0
+        self._files    = {}
+        self._dirty    = set()
+        self._lock     = threading.RLock()
+
+    @staticmethod
+    def Open(directory=DEFAULT_DIRECTORY):
+        '''Return the cache in the given directory, shared by every caller in this process.'''
+        import atexit
+        with DerivedCache._shared_lock:
+            if directory not in DerivedCache._shared:
+                cache = DerivedCache(directory)
+                atexit.register(cache.save)
+                DerivedCache._shared[directory] = cache
+            return DerivedCache._shared[directory]
+
+    def path(self, symbol):
+        '''The path of the file holding the results for the given symbol.'''
+        return f"{self.directory}/{symbol}.derived.json"
+
+    @staticmethod
+    def fingerprint(stock):
+        '''
+        Identify the exact history of a Stock.
+
+        Returns:
+            str: The number of rows, the last date and a hash of the symbol and every column of the history.
+        '''
+        import hashlib
+        history = stock._history
+        digest  = hashlib.blake2b(stock.symbol.encode('utf-8'), digest_size=16)
+        for column in (history.dates, history.prices, history.dividends, history.annualDividends):
+            digest.update(column.tobytes())
+        last = history.dates[-1].item().isoformat() if len(history) != 0 else None
+        return f"{len(history)}/{last}/{digest.hexdigest()}"
+
+    def _load(self, symbol):
+        '''The contents of the file for the given symbol, read on first use.'''
+        import json
+        if symbol not in self._files:
+            contents = {'fingerprint' : None, 'results' : {}}
+            try:
+                with open(self.path(symbol)) as file:
+                    contents = json.load(file)
+            except(FileNotFoundError):
+                pass
+            except(ValueError) as ex:
+                print(f"WARNING: Ignoring unreadable derived results {self.path(symbol)}: {ex}")
+            self._files[symbol] = contents
+        return self._files[symbol]
+
+    def get(self, symbol, fingerprint, key):
+        '''
+        Look up a result.
+
+        Parameters:
+            symbol: The symbol the result was derived for.
+            fingerprint: The fingerprint of the history the result must have been derived from.
+            key (str): Identifies the result and the parameters it was derived with.
+
+        Returns:
+            The stored result, or None if there is no result for this key and history.
+        '''
+        with self._lock:
+            contents = self._load(symbol)
+            if contents['fingerprint'] == fingerprint and key in contents['results']:
+                self.hits += 1
+                return contents['results'][key]
+            self.misses += 1
+            return None
+
+    def put(self, symbol, fingerprint, key, value):
+        '''
+        Store a result, to be written by the next save().
+
+        Parameters:
+            symbol: The symbol the result was derived for.
+            fingerprint: The fingerprint of the history the result was derived from.
+            key (str): Identifies the result and the parameters it was derived with.
+            value: The result. Must be representable in JSON.
+        '''
+        with self._lock:
+            contents = self._load(symbol)
+            if contents['fingerprint'] != fingerprint:
+                contents = {'fingerprint' : fingerprint, 'results' : {}}
+                self._files[symbol] = contents
+            results = contents['results']
+            results.pop(key, None)
+            results[key] = value
+            while len(results) > DerivedCache.MAX_ENTRIES:
+                del results[next(iter(results))]
+            self._dirty.add(symbol)
+
+    def save(self):
+        '''Write the files of every symbol with new results, replacing each old file in one step.'''
+        import json, os
+        with self._lock:
+            for symbol in sorted(self._dirty):
+                path = self.path(symbol)
+                temporary = f"{path}.tmp"
+                try:
+                    with open(temporary, 'w') as file:
+                        json.dump(self._files[symbol], file, indent=1)
+                    os.replace(temporary, path)
+                except(OSError) as ex:
+                    print(f"WARNING: Could not save derived results for {symbol}: {ex}")
+            self._dirty.clear()
@@ -0,0 +1,598 @@
+class History:
+    '''
+    Columnar storage for the known history of a Stock.
+
+    Rows are kept in contiguous numpy arrays instead of one Stock.Snapshot object per day, so analytics can run as
+    array operations. Indexing or iterating a History yields Snapshot views of single rows, so code written against
+    the old list of Stock.Snapshot objects keeps working.
+
+    Members:
+        dates:           (numpy.datetime64[us]) The timestamp of each row.
+        prices:          (USD) The cost of one unit of Stock on each date.
+        dividends:       (USD) The dividend paid on each date.
+        annualDividends: (USD/year) The total dividends paid in the year up to each date.
+    '''
+
+    import numpy
+
+    DATE_DTYPE = numpy.dtype('datetime64[us]')
+
+    class Snapshot:
+        '''
+        A view of a single row in a History. Reads and writes go straight to the underlying arrays.
+
+        Members:
+            price (USD): The cost of one unit of Stock at this time.
+            date: The timestamp for this Snapshot.
+            dividend (USD): The dividend paid on this day.
+            annualDividend (USD/year): The total dividends paid in one year.
+        '''
+        __slots__ = ('_history', '_index')
+
+        def __init__(self, history, index):
+            self._history = history
+            self._index   = index
+
+        @property
+        def price(self):
+            return float(self._history._prices[self._index])
+        @price.setter
+        def price(self, price):
+            self._history._prices[self._index] = price
+            self._history.mark_modified(self._index)
+
+        @property
+        def date(self):
+            return self._history._dates[self._index].item()
+        @date.setter
+        def date(self, date):
+            self._history._dates[self._index] = History.to_datetime64(date)
+            self._history._rows = None
+            self._history.mark_modified(self._index)
+
+        @property
+        def dividend(self):
+            return float(self._history._dividends[self._index])
+        @dividend.setter
+        def dividend(self, dividend):
+            self._history._dividends[self._index] = dividend
+            self._history.mark_modified(self._index)
+
+        @property
+        def annualDividend(self):
+            return float(self._history._annualDividends[self._index])
+        @annualDividend.setter
+        def annualDividend(self, annualDividend):
+            self._history._annualDividends[self._index] = annualDividend
+            self._history.mark_modified(self._index)
+
+        def __repr__(self):
+            return f"Snapshot(date={self.date}, price={self.price}, dividend={self.dividend}, annualDividend={self.annualDividend})"
+
+    def __init__(self, dates=None, prices=None, dividends=None, annualDividends=None):
+        '''
+        Create a new History from whole columns.
+
+        Parameters:
+            dates: Sequence of timestamps (datetime, pandas.Timestamp or numpy.datetime64).
+            prices (USD): Sequence of prices, one per date.
+            dividends (USD): Sequence of dividends, one per date. Defaults to zeros.
+            annualDividends (USD/year): Sequence of annualized dividends, one per date. Defaults to zeros.
+        '''
+        self._dates           = History.to_datetime64_array(dates if dates is not None else [])
+        length                = len(self._dates)
+        self._prices          = History._column(prices, length)
+        self._dividends       = History._column(dividends, length)
+        self._annualDividends = History._column(annualDividends, length)
+        self._length          = length
+        self._rows            = None
+        self._clean           = 0
+        self._version         = 0
+        self._yields          = None
+        self._paid            = None
+
+    @staticmethod
+    def _column(values, length):
+        import numpy
+        if values is None:
+            return numpy.zeros(length, dtype=numpy.float64)
+        column = numpy.array(values, dtype=numpy.float64)
+        if len(column) != length:
+            raise Exception("All History columns must be the same length.")
+        return column
+
+    @staticmethod
+    def to_datetime64(date):
+        '''
+        Convert a timestamp to numpy.datetime64[us].
+
+        Timezone-aware timestamps (such as the ones returned by yfinance) keep their wall-clock time and drop the
+        timezone, so they compare cleanly against naive datetime.datetime.now().
+        '''
+        import numpy
+        if isinstance(date, numpy.datetime64):
+            return date.astype(History.DATE_DTYPE)
+        if getattr(date, 'tzinfo', None) is not None:
+            date = date.replace(tzinfo=None)
+        if hasattr(date, 'to_datetime64'):
+            # pandas.Timestamp
+            return date.to_datetime64().astype(History.DATE_DTYPE)
+        return numpy.datetime64(date, 'us')
+
+    @staticmethod
+    def to_datetime64_array(dates):
+        '''Convert a sequence of timestamps to a numpy.datetime64[us] array.'''
+        import numpy
+        if isinstance(dates, numpy.ndarray) and dates.dtype.kind == 'M':
+            return dates.astype(History.DATE_DTYPE)
+        if hasattr(dates, 'tz_localize'):
+            # pandas.DatetimeIndex
+            if dates.tz is not None:
+                dates = dates.tz_localize(None)
+            return dates.to_numpy().astype(History.DATE_DTYPE)
+        return numpy.array([History.to_datetime64(date) for date in dates], dtype=History.DATE_DTYPE)
+
+    @staticmethod
+    def from_snapshots(snapshots):
+        '''
+        Create a History from a list of Snapshot-like objects.
+
+        Parameters:
+            snapshots: Objects with date, price, dividend and annualDividend members.
+        '''
+        return History(dates           = [snapshot.date for snapshot in snapshots],
+                       prices          = [snapshot.price for snapshot in snapshots],
+                       dividends       = [snapshot.dividend for snapshot in snapshots],
+                       annualDividends = [snapshot.annualDividend for snapshot in snapshots])
+
+    @property
+    def dates(self):
+        '''(numpy.datetime64[us]) The timestamp of each row.'''
+        return self._dates[:self._length]
+
+    @property
+    def prices(self):
+        '''(USD) The cost of one unit of Stock on each date.'''
+        return self._prices[:self._length]
+
+    @property
+    def dividends(self):
+        '''(USD) The dividend paid on each date.'''
+        return self._dividends[:self._length]
+
+    @property
+    def annualDividends(self):
+        '''(USD/year) The total dividends paid in the year up to each date.'''
+        return self._annualDividends[:self._length]
+
+    def _reserve(self, capacity):
+        '''Make sure the columns can hold at least the given number of rows without reallocating.'''
+        import numpy
+        if capacity <= len(self._dates):
+            return
+        capacity = max(capacity, 2 * len(self._dates), 16)
+        def grow(column):
+            grown = numpy.empty(capacity, dtype=column.dtype)
+            grown[:self._length] = column[:self._length]
+            return grown
+        self._dates           = grow(self._dates)
+        self._prices          = grow(self._prices)
+        self._dividends       = grow(self._dividends)
+        self._annualDividends = grow(self._annualDividends)
+
+    KEEP_OPTIONS = ('last', 'first')
+
+    @property
+    def version(self):
+        '''A counter which changes whenever rows are added to or modified in this History.'''
+        return self._version
+
+    @property
+    def clean_rows(self):
+        '''The number of leading rows which have not changed since the last call to mark_clean().'''
+        return self._clean
+
+    def mark_clean(self):
+        '''Record that every row of this History now matches its saved copy.'''
+        self._clean = self._length
+
+    def mark_modified(self, index=0):
+        '''
+        Record that rows from the given index onwards may have changed. Call this after writing to the columns
+        directly; the methods of History call it themselves.
+        '''
+        self._clean = min(self._clean, index)
+        self._version += 1
+
+    def _date_rows(self):
+        '''The dedup index: a dict from date (as int64 microseconds) to row number. Built on first use.'''
+        if self._rows is None:
+            keys = self.dates.view('int64').tolist()
+            self._rows = dict(zip(keys, range(len(keys))))
+        return self._rows
+
+    def append(self, price, date, dividend=0., annualDividend=0., keep='last'):
+        '''
+        Add a row to this History, keeping the rows in chronological order.
+
+        Appending after the latest row is constant time. A row with a date that is already present replaces the
+        existing row (keep="last") or is dropped (keep="first").
+
+        Parameters:
+            price (USD): The cost of one unit of Stock at this time.
+            date: The timestamp for this row.
+            dividend (USD): The dividend paid on this day.
+            annualDividend (USD/year): The total dividends paid in one year.
+            keep ("last" or "first"): Which row to keep when the date is already in this History.
+        '''
+        import numpy
+        if keep not in History.KEEP_OPTIONS:
+            raise ValueError(f"keep must be one of {History.KEEP_OPTIONS}")
+        date = History.to_datetime64(date)
+        key  = int(date.view('int64'))
+        if self._length != 0 and key <= int(self._dates[self._length - 1].view('int64')):
+            rows = self._date_rows()
+            if key in rows:
+                if keep == 'last':
+                    index = rows[key]
+                    self._prices[index]          = price
+                    self._dividends[index]       = dividend
+                    self._annualDividends[index] = annualDividend
+                    self.mark_modified(index)
+                return
+            # An older date we have not seen before. Insert it in place; this shifts rows so the index is rebuilt.
+            index = int(numpy.searchsorted(self.dates, date))
+            self._reserve(self._length + 1)
+            for column in (self._dates, self._prices, self._dividends, self._annualDividends):
+                column[index + 1:self._length + 1] = column[index:self._length]
+            self._rows = None
+            self.mark_modified(index)
+        else:
+            self._reserve(self._length + 1)
+            index = self._length
+            if self._rows is not None:
+                self._rows[key] = index
+        self._dates[index]           = date
+        self._prices[index]          = price
+        self._dividends[index]       = dividend
+        self._annualDividends[index] = annualDividend
+        self._length += 1
+        self._version += 1
+
+    def extend(self, dates, prices, dividends=None, annualDividends=None, keep='last'):
+        '''
+        Add whole columns of rows to this History at once, keeping the rows in chronological order.
+
+        Rows which are already in chronological order and newer than the latest row are copied in linear time.
+        Otherwise the rows are merged with a stable sort. Duplicate dates, either within the new rows or against
+        existing rows, keep the last or the first occurrence.
+
+        Parameters:
+            dates: Sequence of timestamps.
+            prices (USD): Sequence of prices, one per date.
+            dividends (USD): Sequence of dividends, one per date. Defaults to zeros.
+            annualDividends (USD/year): Sequence of annualized dividends, one per date. Defaults to zeros.
+            keep ("last" or "first"): Which row to keep when a date appears more than once.
+        '''
+        import numpy
+        if keep not in History.KEEP_OPTIONS:
+            raise ValueError(f"keep must be one of {History.KEEP_OPTIONS}")
+        new = History(dates, prices, dividends, annualDividends)
+        if len(new) == 0:
+            return
+        keys = new.dates.view('int64')
+        if numpy.all(keys[1:] > keys[:-1]) and (self._length == 0 or keys[0] > int(self._dates[self._length - 1].view('int64'))):
+            self._reserve(self._length + len(new))
+            stop = self._length + len(new)
+            self._dates[self._length:stop]           = new.dates
+            self._prices[self._length:stop]          = new.prices
+            self._dividends[self._length:stop]       = new.dividends
+            self._annualDividends[self._length:stop] = new.annualDividends
+            if self._rows is not None:
+                self._rows.update(zip(keys.tolist(), range(self._length, stop)))
+            self._length = stop
+            self._version += 1
+            return
+
+        # Rows older than every new row are untouched by the merge
+        self.mark_modified(int(numpy.searchsorted(self.dates, new.dates.min())))
+
+        # Existing rows come before new rows, so a stable sort puts the first occurrence of each date first.
+        dates = numpy.concatenate((self.dates, new.dates))
+        order = numpy.argsort(dates, kind='stable')
+        dates = dates[order]
+        if keep == 'first':
+            unique = numpy.concatenate(([True], dates[1:] != dates[:-1]))
+        else:
+            unique = numpy.concatenate((dates[1:] != dates[:-1], [True]))
+        order = order[unique]
+        self._dates           = dates[unique]
+        self._prices          = numpy.concatenate((self.prices, new.prices))[order]
+        self._dividends       = numpy.concatenate((self.dividends, new.dividends))[order]
+        self._annualDividends = numpy.concatenate((self.annualDividends, new.annualDividends))[order]
+        self._length          = len(self._dates)
+        self._rows            = None
+
+    def _yield_prefix(self):
+        '''
+        Running sums of the dividend yield (annualized dividend / price), built once per version of this History.
+
+        Finite yields are summed after subtracting their overall mean, so windows with a small spread in yield do not
+        lose precision. Infinite yields are counted separately, and NaN yields are skipped. The finite yields which
+        differ from the finite yield before them are counted too, so windows of a single repeated yield are recognized
+        and given exact sums rather than the rounding noise left over from the shift.
+        '''
+        import numpy
+        if self._yields is None or self._yields[0] != self._version:
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                yields = self.annualDividends / self.prices
+            finite = numpy.isfinite(yields)
+            shift  = float(numpy.mean(yields[finite])) if finite.any() else 0.
+            shifted = numpy.where(finite, yields - shift, 0.)
+            known   = yields[finite]
+            changes = numpy.zeros(len(yields), dtype=bool)
+            changes[finite] = numpy.concatenate(([True], known[1:] != known[:-1]))
+            def prefix(values):
+                return numpy.concatenate(([0], numpy.cumsum(values)))
+            self._yields = (self._version, shift, prefix(finite), prefix(shifted), prefix(shifted * shifted),
+                            prefix(yields == numpy.inf), prefix(yields == -numpy.inf), yields, prefix(changes))
+        return self._yields
+
+    def yield_moments(self, start=0, stop=None):
+        '''
+        Sums of the dividend yield (annualized dividend / price) over a range of rows, in constant time.
+
+        Parameters:
+            start: The first row of the range.
+            stop: The row to stop at. Defaults to the end of this History.
+
+        Returns:
+            Tuple: (the number of rows with a yield, the sum of their yields, the sum of their squared deviations
+            from their mean). Rows whose yield is NaN are skipped. When every yield in the range is the same, the
+            sum is exactly count times that yield and the deviations are exactly 0.
+        '''
+        import math
+        import numpy
+        stop = self._length if stop is None else stop
+        _, shift, finite, sums, squares, positive, negative, yields, changes = self._yield_prefix()
+        count    = int(finite[stop] - finite[start])
+        positive = int(positive[stop] - positive[start])
+        negative = int(negative[stop] - negative[start])
+        if positive or negative:
+            total = math.nan if positive and negative else (math.inf if positive else -math.inf)
+            return (count + positive + negative, total, math.nan)
+        if count == 0:
+            return (0, 0., 0.)
+        first = int(numpy.searchsorted(finite, finite[start] + 1)) - 1
+        if changes[stop] == changes[first + 1]:
+            return (count, count * float(yields[first]), 0.)
+        total  = float(sums[stop] - sums[start])
+        spread = float(squares[stop] - squares[start]) - total * total / count
+        return (count, total + count * shift, max(spread, 0.))
+
+    def _dividend_prefix(self):
+        '''
+        Running sums of the dividends paid, built once per version of this History.
+
+        Returns:
+            Tuple: (version, the running sum of the finite dividends, the running count of non-finite dividends), each
+            with a leading zero so the sum over rows [start, stop) is prefix[stop] - prefix[start].
+        '''
+        import numpy
+        if self._paid is None or self._paid[0] != self._version:
+            finite = numpy.isfinite(self.dividends)
+            self._paid = (self._version,
+                          numpy.concatenate(([0.], numpy.cumsum(numpy.where(finite, self.dividends, 0.)))),
+                          numpy.concatenate(([0], numpy.cumsum(~finite))))
+        return self._paid
+
+    def dividends_paid(self, start=0, stop=None):
+        '''
+        The total of the dividends paid over a range of rows, in constant time.
+
+        Parameters:
+            start: The first row of the range.
+            stop: The row to stop at. Defaults to the end of this History.
+        '''
+        stop = self._length if stop is None else stop
+        if stop <= start:
+            return 0.
+        _, paid, unknown = self._dividend_prefix()
+        if unknown[stop] != unknown[start]:
+            return float(self.dividends[start:stop].sum())
+        return float(paid[stop] - paid[start])
+
+    def cumulative_dividends(self, start=0, stop=None):
+        '''
+        The running total of the dividends paid since a row, for every row of a range.
+
+        Parameters:
+            start: The first row of the range. Its own dividend is included in every total.
+            stop: The row to stop at. Defaults to the end of this History.
+
+        Returns:
+            numpy array with one total per row, the same as numpy.cumsum(dividends[start:stop]) up to rounding.
+        '''
+        import numpy
+        stop = self._length if stop is None else stop
+        if stop <= start:
+            return numpy.zeros(0)
+        _, paid, unknown = self._dividend_prefix()
+        if unknown[stop] != unknown[start]:
+            return numpy.cumsum(self.dividends[start:stop])
+        return paid[start + 1:stop + 1] - paid[start]
+
+    DIVIDEND_WINDOW_SHORT = numpy.timedelta64(360, 'D')
+    DIVIDEND_WINDOW_LONG  = numpy.timedelta64(370, 'D')
+
+    @staticmethod
+    def trailing_annual_dividends(dates, dividends, method='vectorized'):
+        '''
+        The total dividends paid over the trailing year on each date.
+
+        A dividend stays in the window for 370 days, or for 360 days when measured from a day which pays a dividend
+        itself, so a dividend paid on roughly the same day each year is not counted twice. The window only ever moves
+        forward: a dividend dropped by the shorter window does not come back on later days.
+
+        Both methods run in linear time and sum each window from its oldest dividend to its newest, so they give
+        exactly the same floats as summing the window row by row.
+
+        Parameters:
+            dates (numpy.datetime64): The date of each row, in chronological order.
+            dividends (USD): The dividend paid on each date.
+            method ("vectorized" or "streaming"): Compute with whole-array operations, or one row at a time.
+
+        Returns:
+            (USD/year) numpy array of the annualized dividend on each date.
+        '''
+        import numpy
+        keys      = History.to_datetime64_array(dates).view(numpy.int64)
+        dividends = numpy.asarray(dividends, dtype=numpy.float64)
+        short     = int(History.DIVIDEND_WINDOW_SHORT / numpy.timedelta64(1, 'us'))
+        long      = int(History.DIVIDEND_WINDOW_LONG / numpy.timedelta64(1, 'us'))
+        if method == 'streaming':
+            import collections
+            annual = numpy.empty(len(keys))
+            paying = collections.deque()
+            values = dividends.tolist()
+            keys   = keys.tolist()
+            start  = 0
+            total  = 0.
+            for index, (date, dividend) in enumerate(zip(keys, values)):
+                changed = dividend != 0.
+                limit   = date - (short if changed else long)
+                while keys[start] < limit:
+                    if paying and paying[0] == start:
+                        paying.popleft()
+                        changed = True
+                    start += 1
+                if dividend != 0.:
+                    paying.append(index)
+                if changed:
+                    total = 0.
+                    for paid in paying:
+                        total += values[paid]
+                annual[index] = total
+            return annual
+        if method != 'vectorized':
+            raise ValueError("method must be \"vectorized\" or \"streaming\"")
+
+        # The oldest row still in the window on each date
+        limits = keys - numpy.where(dividends != 0., short, long)
+        starts = numpy.maximum.accumulate(numpy.searchsorted(keys, limits, side='left')) if len(keys) else limits
+        # Each window holds a contiguous run of the dividend-paying rows. Add them up oldest first.
+        paying = numpy.flatnonzero(dividends != 0.)
+        first  = numpy.searchsorted(paying, starts, side='left')
+        counts = numpy.searchsorted(paying, numpy.arange(len(keys)), side='right') - first
+        values = dividends[paying]
+        annual = numpy.zeros(len(keys))
+        for offset in range(int(counts.max()) if len(counts) else 0):
+            inside = counts > offset
+            annual[inside] += values[first[inside] + offset]
+        return annual
+
+    BINARY_MAGIC     = b'STKHIST1'
+    BINARY_ALIGNMENT = 64
+
+    def save(self, path, metadata=None):
+        '''
+        Write this History to a binary cache file which load() can memory-map.
+
+        The file is an 8 byte magic string, the length of a JSON header, the JSON header itself (row count plus any
+        metadata) padded to a 64 byte boundary, then the dates (int64 microseconds), prices, dividends and annualized
+        dividends (float64) as contiguous little-endian columns. The file is written to a temporary path and renamed
+        into place, so readers never see a partial file.
+
+        Parameters:
+            path: Where to write the cache file.
+            metadata (dict): Extra JSON-serializable values to store in the header.
+        '''
+        import json, os, struct
+        import numpy
+        header = dict(metadata or {})
+        header['rows'] = self._length
+        header = json.dumps(header).encode('utf-8')
+        padding = -(len(History.BINARY_MAGIC) + 8 + len(header)) % History.BINARY_ALIGNMENT
+        header += b' ' * padding
+
+        # The columns may be mapped from the file about to be replaced, which Windows does not allow
+        self.unmap()
+        temporary = f"{path}.tmp"
+        with open(temporary, 'wb') as file:
+            file.write(History.BINARY_MAGIC)
+            file.write(struct.pack('<Q', len(header)))
+            file.write(header)
+            file.write(self.dates.view(numpy.int64).astype('<i8').tobytes())
+            for column in (self.prices, self.dividends, self.annualDividends):
+                file.write(column.astype('<f8').tobytes())
+        os.replace(temporary, path)
+
+    @staticmethod
+    def load(path):
+        '''
+        Memory-map a binary cache file written by save().
+
+        The columns are copy-on-write views of the file, so processes which load the same file share its pages and
+        nothing is parsed or copied until the History is modified.
+
+        Parameters:
+            path: The cache file to load.
+
+        Returns:
+            Tuple: (History, dict of the metadata stored with it).
+        '''
+        import json, struct
+        import numpy
+        with open(path, 'rb') as file:
+            if file.read(len(History.BINARY_MAGIC)) != History.BINARY_MAGIC:
+                raise ValueError(f"{path} is not a History cache file.")
+            header_length, = struct.unpack('<Q', file.read(8))
+            metadata = json.loads(file.read(header_length).decode('utf-8'))
+        rows   = metadata.pop('rows')
+        offset = len(History.BINARY_MAGIC) + 8 + header_length
+        history = History()
+        if rows != 0:
+            columns = numpy.memmap(path, dtype='<i8', mode='c', offset=offset, shape=(4, rows))
+            history._dates           = columns[0].view(History.DATE_DTYPE)
+            history._prices          = columns[1].view('<f8')
+            history._dividends       = columns[2].view('<f8')
+            history._annualDividends = columns[3].view('<f8')
+            history._length          = rows
+        return history, metadata
+
+    def unmap(self):
+        '''
+        Copy the columns of a History memory-mapped by load() into memory, so this History no longer holds the file
+        open and it can be replaced or deleted. Does nothing if the columns are not mapped.
+        '''
+        import numpy
+        if isinstance(self._dates, numpy.memmap):
+            self._dates           = numpy.array(self._dates[:self._length])
+            self._prices          = numpy.array(self._prices[:self._length])
+            self._dividends       = numpy.array(self._dividends[:self._length])
+            self._annualDividends = numpy.array(self._annualDividends[:self._length])
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            return History(dates           = self._dates[start:stop:step],
+                           prices          = self._prices[start:stop:step],
+                           dividends       = self._dividends[start:stop:step],
+                           annualDividends = self._annualDividends[start:stop:step])
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError("History index out of range")
+        return History.Snapshot(self, index)
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield History.Snapshot(self, index)
+
+    def __repr__(self):
+        if self._length == 0:
+            return "History([])"
+        return f"History({self._length} rows from {self.dates[0]} to {self.dates[-1]})"
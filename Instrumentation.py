@@ -0,0 +1,255 @@
+'''
+Opt-in instrumentation: named timing spans, counters per symbol and peak memory samples, summarized at the end of a
+run.
+
+Nothing is recorded until enable() is called, and while disabled span() hands back a shared do-nothing context
+manager and count() returns at once, so instrumented code costs about one function call per span. Setting the
+STOCKS_INSTRUMENT environment variable enables instrumentation when this module is first imported and prints the
+report when the process exits:
+
+    STOCKS_INSTRUMENT=1             Time spans and count events.
+    STOCKS_INSTRUMENT=memory        Also trace Python memory allocations with tracemalloc, which is much slower.
+    STOCKS_INSTRUMENT_TRACE=<path>  Also write every span to a trace file, viewable in chrome://tracing or Perfetto.
+
+Worker processes, such as the ones Stock.LoadMany parses with, record into their own copy of this module, which is
+not merged into the report.
+'''
+
+import threading
+
+MAX_EVENTS = 1000000  # Spans kept for the trace file. Later spans are still totalled.
+
+_active  = False
+_lock    = threading.Lock()
+_origin  = 0.
+_spans   = {}         # name -> [calls, total seconds, longest seconds]
+_counts  = {}         # (name, symbol) -> amount
+_events  = []         # (name, symbol, start, duration, thread id)
+_memory  = []         # (label, current bytes, peak bytes, peak resident bytes)
+
+
+class _NullSpan:
+    '''The span handed out while instrumentation is disabled.'''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    '''A span being timed.'''
+    __slots__ = ('name', 'symbol', 'start')
+
+    def __init__(self, name, symbol):
+        self.name   = name
+        self.symbol = symbol
+
+    def __enter__(self):
+        import time
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        import time
+        duration = time.perf_counter() - self.start
+        with _lock:
+            totals = _spans.get(self.name)
+            if totals is None:
+                _spans[self.name] = [1, duration, duration]
+            else:
+                totals[0] += 1
+                totals[1] += duration
+                totals[2]  = max(totals[2], duration)
+            if len(_events) < MAX_EVENTS:
+                _events.append((self.name, self.symbol, self.start, duration, threading.get_ident()))
+        return False
+
+
+def enabled():
+    '''Whether instrumentation is recording.'''
+    return _active
+
+
+def enable(memory=False):
+    '''
+    Start recording.
+
+    Parameters:
+        memory: Also trace Python memory allocations with tracemalloc, so memory samples include the peak allocated
+            by Python. This slows down allocation-heavy code considerably.
+    '''
+    global _active, _origin
+    import time
+    if memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    if not _active:
+        _origin = time.perf_counter()
+    _active = True
+
+
+def disable():
+    '''Stop recording. What has been recorded so far is kept until reset().'''
+    global _active
+    _active = False
+    import tracemalloc
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    '''Forget everything recorded so far.'''
+    global _origin
+    import time
+    with _lock:
+        _spans.clear()
+        _counts.clear()
+        _events.clear()
+        _memory.clear()
+        _origin = time.perf_counter()
+
+
+def span(name, symbol=None):
+    '''
+    A context manager which times its body under the given name.
+
+    Parameters:
+        name: What is being timed. Spans with the same name are totalled together.
+        symbol: The symbol being worked on, if any. Kept with the span in the trace file.
+    '''
+    if not _active:
+        return _NULL_SPAN
+    return _Span(name, symbol)
+
+
+def timed(name):
+    '''A decorator which times every call of a function as a span with the given name.'''
+    import functools
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _active:
+                return function(*args, **kwargs)
+            with _Span(name, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, amount=1, symbol=None):
+    '''
+    Add to a counter.
+
+    Parameters:
+        name: What is being counted, such as "rows parsed".
+        amount: How much to add.
+        symbol: The symbol the count belongs to, if any. Counters are reported in total and per symbol.
+    '''
+    if not _active:
+        return
+    with _lock:
+        _counts[(name, symbol)] = _counts.get((name, symbol), 0) + amount
+
+
+def sample_memory(label):
+    '''
+    Record the memory in use now, and the peak so far.
+
+    Python's own allocations are only known while memory tracing is on (see enable). The peak resident size of the
+    process is recorded where the platform reports it.
+    '''
+    if not _active:
+        return
+    import tracemalloc
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+    with _lock:
+        _memory.append((label, current, peak, _peak_resident()))
+
+
+def _peak_resident():
+    '''The peak resident size of this process in bytes, or None where it is not available.'''
+    try:
+        import resource, sys
+    except(ImportError):
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def report(top=5):
+    '''
+    Summarize everything recorded so far.
+
+    Parameters:
+        top: How many symbols to list for each counter.
+
+    Returns:
+        str: Tables of the spans by total time, the counters with their largest symbols, and the memory samples.
+    '''
+    def megabytes(size):
+        return "-" if size is None else f"{size / 1048576.:.1f}"
+    with _lock:
+        spans  = sorted(_spans.items(), key=lambda item: -item[1][1])
+        counts = dict(_counts)
+        memory = list(_memory)
+    lines = ["Spans:", f"    {'name':<36} {'calls':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}"]
+    for name, (calls, total, longest) in spans:
+        lines.append(f"    {name:<36} {calls:>8} {total:>10.4f} {1e3 * total / calls:>10.3f} {1e3 * longest:>10.3f}")
+    lines.append("Counters:")
+    for name in sorted(set(name for name, _ in counts)):
+        bySymbol = sorted(((amount, symbol) for (counter, symbol), amount in counts.items()
+                           if counter == name and symbol is not None), reverse=True)
+        total = sum(amount for (counter, _), amount in counts.items() if counter == name)
+        largest = ", ".join(f"{symbol} {amount}" for amount, symbol in bySymbol[:top])
+        lines.append(f"    {name:<36} {total:>12}" + (f"    largest: {largest}" if largest else ""))
+    if memory:
+        lines.append("Memory (MB):")
+        lines.append(f"    {'label':<36} {'current':>10} {'peak':>10} {'resident':>10}")
+        for label, current, peak, resident in memory:
+            lines.append(f"    {label:<36} {megabytes(current):>10} {megabytes(peak):>10} {megabytes(resident):>10}")
+    return "\n".join(lines)
+
+
+def write_trace(path):
+    '''
+    Write every recorded span to a file in the Chrome trace event format, with the counters and memory samples
+    alongside.
+    '''
+    import json, os
+    with _lock:
+        events = [{'name' : name, 'ph' : 'X', 'ts' : 1e6 * (start - _origin), 'dur' : 1e6 * duration,
+                   'pid' : os.getpid(), 'tid' : thread, 'args' : {} if symbol is None else {'symbol' : symbol}}
+                  for name, symbol, start, duration, thread in _events]
+        counters = [{'name' : name, 'symbol' : symbol, 'amount' : amount} for (name, symbol), amount in _counts.items()]
+        memory   = [{'label' : label, 'current' : current, 'peak' : peak, 'resident' : resident}
+                    for label, current, peak, resident in _memory]
+    with open(path, 'w') as file:
+        json.dump({'traceEvents' : events, 'counters' : counters, 'memory' : memory}, file)
+
+
+def _finish(trace):
+    '''Report at the end of a run enabled by the STOCKS_INSTRUMENT environment variable.'''
+    import sys
+    sample_memory("exit")
+    print(report(), file=sys.stderr)
+    if trace:
+        write_trace(trace)
+        print(f"Trace written to {trace}", file=sys.stderr)
+
+
+def _configure():
+    '''Enable instrumentation if the STOCKS_INSTRUMENT environment variable asks for it.'''
+    import atexit, os
+    setting = os.environ.get('STOCKS_INSTRUMENT', '')
+    if setting in ('', '0'):
+        return
+    enable(memory=setting == 'memory')
+    atexit.register(_finish, os.environ.get('STOCKS_INSTRUMENT_TRACE'))
+
+_configure()
@@ -0,0 +1,274 @@
+'''
+Sources of market data for Stock.Update, and an engine to refresh many Stocks from them concurrently.
+
+A Provider supplies two things per symbol: an info dict (using yfinance's keys such as "shortName", "forwardPE" and
+"shortPercentOfFloat") and a price history frame (a pandas.DataFrame indexed by date with "Open" and "Dividends"
+columns, like yfinance.Ticker.history). YfinanceProvider fetches them from the yfinance API. FakeProvider serves
+them from memory so refreshes can be tested and benchmarked without network access.
+'''
+
+class RateLimiter:
+    '''
+    A thread-safe token bucket which spaces out calls to a Provider.
+
+    Members:
+        rate:  The sustained number of calls allowed per second. None disables limiting.
+        burst: The number of calls which may be made back to back before limiting starts.
+    '''
+
+    def __init__(self, rate=None, burst=1):
+        import threading, time
+        self.rate    = rate
+        self.burst   = burst
+        self._tokens = float(burst)
+        self._last   = time.monotonic()
+        self._lock   = threading.Lock()
+
+    def acquire(self):
+        '''Block until a call is allowed.'''
+        import time
+        if self.rate == None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last   = now
+                if self._tokens >= 1.:
+                    self._tokens -= 1.
+                    return
+                wait = (1. - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Provider:
+    '''
+    Interface for a source of market data. Subclasses implement _info and _history; callers use info and history,
+    which apply this Provider's rate limit.
+
+    Members:
+        name:    A short name for this Provider, used in log messages.
+        limiter: (RateLimiter) The rate limit shared by every call to this Provider.
+    '''
+    name = "provider"
+
+    def __init__(self, requests_per_second=None, burst=1):
+        '''
+        Parameters:
+            requests_per_second: The sustained number of requests allowed per second. None disables limiting.
+            burst: The number of requests which may be made back to back before limiting starts.
+        '''
+        self.limiter = RateLimiter(requests_per_second, burst)
+
+    def info(self, symbol):
+        '''
+        Fetch the info dict of a symbol.
+
+        Returns:
+            dict with yfinance's keys. Empty if nothing is known about the symbol.
+        '''
+        self.limiter.acquire()
+        return self._info(symbol) or {}
+
+    def history(self, symbol, start=None):
+        '''
+        Fetch the daily price history of a symbol.
+
+        Parameters:
+            symbol: The symbol to fetch.
+            start (datetime): The first date to fetch. None fetches the whole history.
+
+        Returns:
+            pandas.DataFrame indexed by date with "Open" and "Dividends" columns.
+        '''
+        self.limiter.acquire()
+        return self._history(symbol, start)
+
+    def _info(self, symbol):
+        raise NotImplementedError()
+
+    def _history(self, symbol, start):
+        raise NotImplementedError()
+
+
+class YfinanceProvider(Provider):
+    '''Market data from the yfinance API.'''
+    name = "yfinance"
+
+    def __init__(self, requests_per_second=2., burst=4):
+        super().__init__(requests_per_second, burst)
+
+    def _info(self, symbol):
+        import yfinance as yf
+        return yf.Ticker(symbol).info
+
+    def _history(self, symbol, start):
+        import yfinance as yf
+        if start == None:
+            return yf.Ticker(symbol).history(period="max")
+        return yf.Ticker(symbol).history(start=start)
+
+
+class FakeProvider(Provider):
+    '''
+    Market data served from memory, for tests and benchmarks.
+
+    Symbols without a stored frame get a deterministic synthetic history: a daily random walk seeded by the symbol,
+    with a quarterly dividend.
+
+    Members:
+        frames:   (Dict[str, pandas.DataFrame]) Stored price history frames by symbol.
+        infos:    (Dict[str, dict]) Stored info dicts by symbol.
+        failures: (Dict[str, int]) How many more times each symbol should fail before succeeding.
+        latency:  Seconds to sleep on every call, to imitate a network round trip.
+        calls:    The number of calls made to this Provider.
+    '''
+    name = "fake"
+
+    def __init__(self, frames=None, infos=None, failures=None, latency=0., requests_per_second=None, burst=1):
+        import threading
+        super().__init__(requests_per_second, burst)
+        self.frames   = dict(frames or {})
+        self.infos    = dict(infos or {})
+        self.failures = dict(failures or {})
+        self.latency  = latency
+        self.calls    = 0
+        self._lock    = threading.Lock()
+
+    @staticmethod
+    def from_stocks(stocks):
+        '''Create a FakeProvider which serves the histories and header fields of the given Stocks.'''
+        import pandas
+        frames = {}
+        infos  = {}
+        for stock in stocks:
+            history = stock._history
+            frames[stock.symbol] = pandas.DataFrame({'Open'      : history.prices,
+                                                     'Dividends' : history.dividends},
+                                                    index=pandas.DatetimeIndex(history.dates, name='Date'))
+            infos[stock.symbol]  = {'shortName'           : stock.name,
+                                    'forwardPE'           : stock._pe_ratio,
+                                    'shortPercentOfFloat' : stock._short_percent_of_float}
+        return FakeProvider(frames, infos)
+
+    @staticmethod
+    def synthetic_frame(symbol, rows=2500, end=None, freq='B'):
+        '''
+        A deterministic synthetic price history frame.
+
+        Parameters:
+            symbol: Seeds the random walk, so the same symbol always gets the same history.
+            rows: The number of trading days.
+            end (datetime): The last date. Defaults to today.
+            freq: The pandas frequency of the dates. Business days by default. "D" fits about 40% more rows into
+                the dates pandas can represent, which start in 1677.
+        '''
+        import datetime, zlib
+        import numpy, pandas
+        random = numpy.random.default_rng(zlib.crc32(symbol.encode('utf-8')))
+        end    = (end or datetime.datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        dates  = pandas.date_range(end=end, periods=rows, freq=freq, name='Date')
+        prices = 20. * numpy.exp(numpy.cumsum(random.normal(0.0003, 0.015, rows)))
+        dividends = numpy.zeros(rows)
+        dividends[63::63] = numpy.round(prices[63::63] * 0.01, 4)
+        return pandas.DataFrame({'Open' : prices, 'Dividends' : dividends}, index=dates)
+
+    def _call(self, symbol):
+        import time
+        with self._lock:
+            self.calls += 1
+            failing = self.failures.get(symbol, 0)
+            if failing:
+                self.failures[symbol] = failing - 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failing:
+            raise ConnectionError(f"Simulated failure fetching {symbol}")
+
+    def _info(self, symbol):
+        self._call(symbol)
+        return dict(self.infos.get(symbol, {'shortName' : symbol}))
+
+    def _history(self, symbol, start):
+        self._call(symbol)
+        if symbol not in self.frames:
+            self.frames[symbol] = FakeProvider.synthetic_frame(symbol)
+        frame = self.frames[symbol]
+        if start != None:
+            frame = frame[frame.index >= start]
+        return frame.copy()
+
+
+class RefreshEngine:
+    '''
+    Update many Stocks from a Provider concurrently.
+
+    Symbols are refreshed by a bounded pool of worker threads. Every request goes through the Provider's rate
+    limiter, and a failed refresh is retried with exponential backoff.
+
+    Members:
+        provider: (Provider) Where the data comes from.
+        workers:  The maximum number of symbols refreshed at once.
+        retries:  How many times a failed refresh is retried.
+        backoff:  Seconds to wait before the first retry. Doubles after every failure.
+        save:     Whether refreshed Stocks are written back to the cache.
+        incremental: Whether Stocks with a history only fetch the rows after their latest Snapshot.
+    '''
+
+    def __init__(self, provider=None, workers=8, retries=3, backoff=1., save=True, incremental=True):
+        self.provider = provider if provider is not None else YfinanceProvider()
+        self.incremental = incremental
+        self.workers  = workers
+        self.retries  = retries
+        self.backoff  = backoff
+        self.save     = save
+
+    def refresh_one(self, stock):
+        '''
+        Update one Stock, retrying failures.
+
+        Parameters:
+            stock (Stock or str): The Stock to update, or a symbol to create a new Stock for.
+
+        Returns:
+            Stock.LoadResult holding the updated Stock, or the last error if every attempt failed.
+        '''
+        import time
+        from Stocks import Stock
+        if not isinstance(stock, Stock):
+            stock = Stock(symbol=stock)
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                stock.Update(provider=self.provider, incremental=self.incremental)
+                if self.save:
+                    stock.SaveToCSV()
+                    stock.SaveToBinary()
+                return Stock.LoadResult(stock.symbol, stock=stock)
+            except Exception as ex:
+                if attempt == self.retries:
+                    return Stock.LoadResult(stock.symbol, error=ex)
+                print(f"Refreshing {stock.symbol} from {self.provider.name} failed ({ex}). Retrying in {delay:.1f}s.")
+                time.sleep(delay)
+                delay *= 2.
+
+    def refresh(self, stocks):
+        '''
+        Update many Stocks concurrently.
+
+        Parameters:
+            stocks ([Stock or str]): The Stocks to update, or symbols to create new Stocks for.
+
+        Returns:
+            [Stock.LoadResult] in the same order as stocks.
+        '''
+        from CacheManifest import CacheManifest
+        if self.workers <= 1 or len(stocks) <= 1:
+            results = [self.refresh_one(stock) for stock in stocks]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(stocks))) as executor:
+                results = list(executor.map(self.refresh_one, stocks))
+        if self.save:
+            CacheManifest.Open().save()
+        return results
@@ -0,0 +1,347 @@
+'''
+A non-interactive screener: the load, fit, score and allocate pipeline of TestCaseWithFit, runnable on a batch host.
+
+Each phase is a separate function so it can be timed, replaced or parallelized on its own, and run() chains them
+while timing each one. Run this file directly to screen from the command line:
+
+    python Screener.py --universe green,energy --years 5 10 --format json --output picks.json
+
+The universe may mix the symbol groups defined in testCase.py ("green", "energy", "reits", ..., or "all" for the
+default symbols) with files listing symbols, separated by commas, whitespace or newlines. "#" starts a comment.
+'''
+
+N_STDEVS = 2.         # Number of standard deviations to use for fitness
+BOOST_FACTOR = 1.5
+NERF_FACTOR  = 0.5
+LIMIT     = 0.25      # Don't recommend more than this share in any one asset
+MIN_SHARE = 0.05      # Stop recommending once a candidate would get less than this share
+
+class Candidate:
+    '''
+    The score of one Stock over one horizon, and the share of the portfolio recommended for it.
+
+    Members:
+        symbol:      The symbol of the Stock.
+        years:       The number of years the Stock was fitted over.
+        score:       The fitness of the Stock, after boosting or nerfing. Adjusted by allocate().
+        rate:        The APR of the fit, in percent.
+        undervalue:  How far the current value is below the fit, in percent.
+        uncertainty: The relative uncertainty of the fit, in percent.
+        pe_ratio:    The forward P/E ratio of the Stock.
+        percent:     The recommended share of the portfolio, in percent. 0 if the Stock is not recommended.
+    '''
+
+    FIELDS = ('symbol', 'years', 'percent', 'score', 'rate', 'undervalue', 'uncertainty', 'pe_ratio')
+
+    def __init__(self, symbol, years, score, rate, undervalue, uncertainty, pe_ratio):
+        self.symbol      = symbol
+        self.years       = years
+        self.score       = score
+        self.rate        = rate
+        self.undervalue  = undervalue
+        self.uncertainty = uncertainty
+        self.pe_ratio    = pe_ratio
+        self.percent     = 0.
+
+    def as_dict(self):
+        '''The members of this Candidate, in the order of FIELDS.'''
+        return {field : getattr(self, field) for field in Candidate.FIELDS}
+
+
+class ScreenResult:
+    '''
+    The output of run().
+
+    Members:
+        candidates: ([Candidate]) Every scored Stock for every horizon, best first within each horizon.
+        failures:   (Dict[str, str]) Why each symbol which could not be loaded, fitted or scored was left out, by
+                    symbol. Symbols which only failed for some horizons are listed as "<symbol> <years>".
+        timings:    (Dict[str, float]) The seconds spent in each phase.
+    '''
+
+    def __init__(self):
+        self.candidates = []
+        self.failures   = {}
+        self.timings    = {'load' : 0., 'fit' : 0., 'score' : 0., 'allocate' : 0.}
+
+    def to_json(self):
+        '''This result as a JSON document. Infinite and NaN values, such as a missing P/E ratio, become null.'''
+        import json, math
+        def finite(value):
+            return None if isinstance(value, float) and not math.isfinite(value) else value
+        return json.dumps({'candidates' : [{field : finite(value) for field, value in candidate.as_dict().items()}
+                                           for candidate in self.candidates],
+                           'failures'   : self.failures,
+                           'timings'    : self.timings}, indent=1)
+
+    def to_csv(self):
+        '''The candidates of this result as CSV, one row per Stock and horizon.'''
+        import csv, io
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=Candidate.FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for candidate in self.candidates:
+            writer.writerow(candidate.as_dict())
+        return output.getvalue()
+
+
+def resolve_symbols(names):
+    '''
+    Expand group names and symbol files into a list of symbols.
+
+    Parameters:
+        names ([str]): Group names from testCase.py, "all", paths to files listing symbols, or symbols themselves.
+
+    Returns:
+        [str] with every symbol once, in the order first given.
+    '''
+    import os, re
+    import testCase
+    symbols = []
+    for name in names:
+        if name == "all":
+            symbols.extend(sorted(testCase.symbols))
+        elif isinstance(getattr(testCase, name, None), list):
+            symbols.extend(getattr(testCase, name))
+        elif os.path.isfile(name):
+            with open(name) as file:
+                for line in file:
+                    symbols.extend(re.split(r"[\s,]+", line.split('#')[0].strip()))
+        else:
+            symbols.append(name)
+    return [symbol for symbol in dict.fromkeys(symbols) if symbol]
+
+
+def load(symbols, offline=False, max_age_days=5, workers=None):
+    '''
+    Load the Stocks to screen, downloading missing or stale ones unless offline.
+
+    Parameters:
+        symbols ([str]): The symbols to load.
+        offline: Only use the cache. Missing symbols fail instead of being downloaded.
+        max_age_days: How old the latest cached Snapshot may be before the Stock is refreshed.
+        workers: Number of worker processes for parsing, as in Stock.LoadMany.
+
+    Returns:
+        Tuple: ([Stock] with a history, Dict[str, str] of why each other symbol failed).
+    '''
+    import datetime
+    from Stocks import Stock
+    minDate = None if offline else datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+    stocks   = []
+    failures = {}
+    for result in Stock.LoadMany(symbols, minDate=minDate, workers=workers, downloadMissing=not offline):
+        if result.error is not None:
+            failures[result.symbol] = str(result.error)
+        elif len(result.stock.history) == 0:
+            failures[result.symbol] = "No history"
+        else:
+            stocks.append(result.stock)
+    return stocks, failures
+
+
+def fit(stocks, years, mode='coarse'):
+    '''Fit every Stock over the given number of years. Returns AprFit.AprFitBatch, as Stock.get_apr_fits does.'''
+    from Stocks import Stock
+    return Stock.get_apr_fits(stocks, years=years, mode=mode)
+
+
+def score(stocks, fits, years, boost=(), nerf=(), today=None):
+    '''
+    Score every Stock the way TestCaseWithFit does.
+
+    Parameters:
+        stocks ([Stock]): The Stocks which were fitted.
+        fits (AprFit.AprFitBatch): The fit of each Stock, as returned by fit().
+        years: The number of years the Stocks were fitted over.
+        boost, nerf: Symbols whose scores are multiplied by BOOST_FACTOR and NERF_FACTOR.
+        today (datetime): The date to screen as of. Defaults to now.
+
+    Returns:
+        Tuple: ([Candidate], Dict[str, str] of why each other Stock was left out). Stocks without enough history are
+        left out silently.
+    '''
+    import datetime, math
+    today = today or datetime.datetime.now()
+    startDate  = today - datetime.timedelta(seconds = 366 * years * 60 * 60 * 24)
+    candidates = []
+    failures   = {}
+    for index, stock in enumerate(stocks):
+        if stock.history[0].date > startDate:
+            continue
+        try:
+            apr_fit = fits.fit(index)
+        except Exception as ex:
+            failures[stock.symbol] = f"Failed to fit curve: {ex}"
+            continue
+
+        # Determine how much this stock is currently overvalued/undervalued
+        t_0_date = today + datetime.timedelta(seconds=apr_fit.t_0 * 31557600.)
+        total_dividends_since_t_0 = stock.dividends_between(t_0_date)
+        current = stock.history[-1].price + total_dividends_since_t_0
+        undervalue = (apr_fit.y_0 * (1 + apr_fit.rate) ** (0. - apr_fit.t_0) - current) / current
+
+        if apr_fit.stdev * N_STDEVS > 1.:
+            fitness = 0.
+        else:
+            # stdev applies as both uncertainty in the fit and as potential loss
+            fitness = (apr_fit.rate + undervalue / 4.) * (1. - N_STDEVS * apr_fit.stdev) + 1. / stock.pe_ratio
+        if math.isnan(fitness):
+            failures[stock.symbol] = "Failed to calculate score"
+            continue
+        if stock.symbol in boost:
+            fitness *= BOOST_FACTOR
+        if stock.symbol in nerf:
+            fitness *= NERF_FACTOR
+        candidates.append(Candidate(stock.symbol, years, fitness, 100. * apr_fit.rate, 100. * undervalue,
+                                    100. * apr_fit.stdev, stock.pe_ratio))
+    return candidates, failures
+
+
+def allocate(candidates, limit=LIMIT, min_share=MIN_SHARE):
+    '''
+    Recommend a share of the portfolio for the best candidates, the way TestCaseWithFit does.
+
+    Candidates are taken best first while each one adds at least min_share of the total score. The top two are then
+    capped at limit of the total, and what they give up is spread over the rest.
+
+    Parameters:
+        candidates ([Candidate]): The candidates of one horizon. Sorted best first, and their percent set, in place.
+        limit: The largest share recommended for one candidate.
+        min_share: The smallest share worth recommending.
+
+    Returns:
+        [Candidate] The recommended candidates, best first.
+    '''
+    candidates.sort(key=lambda x:x.score, reverse=True)
+    number_of_recommendations = 0
+    total = 0.
+    for candidate in candidates:
+        if candidate.score <= 0.:
+            continue
+        total += candidate.score
+        if candidate.score / total < min_share:
+            total -= candidate.score
+            break
+        number_of_recommendations += 1
+
+    if number_of_recommendations > 1 and candidates[0].score > total * limit:
+        redistribution = (candidates[0].score - total * limit) / (number_of_recommendations - 1)
+        for candidate in candidates:
+            candidate.score += redistribution
+        if number_of_recommendations > 2 and candidates[1].score > total * limit:
+            redistribution = (candidates[1].score - total * limit) / (number_of_recommendations - 2)
+            for candidate in candidates:
+                candidate.score += redistribution
+            candidates[1].score = total * limit
+        candidates[0].score = total * limit
+
+    recommended = candidates[:number_of_recommendations]
+    for candidate in recommended:
+        candidate.percent = 100. * candidate.score / total
+    return recommended
+
+
+def run(symbols, horizons=(10.,), boost=(), nerf=(), limit=LIMIT, min_share=MIN_SHARE, mode='coarse', offline=False,
+        max_age_days=5, workers=None):
+    '''
+    Load, fit, score and allocate a universe of Stocks over every horizon.
+
+    Parameters:
+        symbols ([str]): The universe to screen.
+        horizons: The numbers of years to fit over. Each is screened and allocated separately.
+        boost, nerf: Symbols whose scores are multiplied by BOOST_FACTOR and NERF_FACTOR.
+        limit, min_share: Allocation limits, as in allocate().
+        mode ("coarse" or "exhaustive"): How AprFit searches for the basis point of each curve.
+        offline, max_age_days, workers: How to load the Stocks, as in load().
+
+    Returns:
+        ScreenResult
+    '''
+    import datetime, time
+    import Instrumentation
+    result = ScreenResult()
+    start  = time.perf_counter()
+    with Instrumentation.span("Screener load"):
+        stocks, result.failures = load(symbols, offline=offline, max_age_days=max_age_days, workers=workers)
+    result.timings['load'] = time.perf_counter() - start
+    Instrumentation.sample_memory("Screener load")
+
+    today = datetime.datetime.now()
+    boost = set(boost)
+    nerf  = set(nerf)
+    for years in horizons:
+        start = time.perf_counter()
+        with Instrumentation.span("Screener fit"):
+            fits = fit(stocks, years, mode=mode)
+        result.timings['fit'] += time.perf_counter() - start
+        Instrumentation.sample_memory(f"Screener fit {years:g}")
+
+        start = time.perf_counter()
+        with Instrumentation.span("Screener score"):
+            candidates, failures = score(stocks, fits, years, boost=boost, nerf=nerf, today=today)
+        result.failures.update((f"{symbol} {years:g}", reason) for symbol, reason in failures.items())
+        result.timings['score'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with Instrumentation.span("Screener allocate"):
+            allocate(candidates, limit=limit, min_share=min_share)
+        result.candidates.extend(candidates)
+        result.timings['allocate'] += time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    '''Run the screener from the command line. Returns the exit status.'''
+    import argparse, contextlib, sys
+    import Instrumentation, testCase
+    from Stocks import Stock
+    parser = argparse.ArgumentParser(description="Screen a universe of stocks and recommend an allocation.")
+    parser.add_argument('--universe', default="all",
+                        help="Comma separated group names from testCase.py, files listing symbols, or symbols.")
+    parser.add_argument('--years', type=float, nargs='+', default=[10.], help="Horizons to fit over, in years.")
+    parser.add_argument('--boost', default=None, help="Comma separated groups or symbols to boost. Defaults to testCase.boost.")
+    parser.add_argument('--nerf', default=None, help="Comma separated groups or symbols to nerf. Defaults to testCase.nerf.")
+    parser.add_argument('--limit', type=float, default=LIMIT, help="Largest share recommended for one asset.")
+    parser.add_argument('--min-share', type=float, default=MIN_SHARE, help="Smallest share worth recommending.")
+    parser.add_argument('--mode', choices=('coarse', 'exhaustive'), default='coarse', help="How to search for fits.")
+    parser.add_argument('--offline', action='store_true', help="Only use cached histories. Never download.")
+    parser.add_argument('--max-age-days', type=float, default=5, help="Refresh histories older than this.")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for parsing the cache.")
+    parser.add_argument('--format', choices=('json', 'csv'), default='json', help="Output format.")
+    parser.add_argument('--output', default=None, help="File to write to. Defaults to standard output.")
+    parser.add_argument('--instrument', action='store_true',
+                        help="Time each phase and count events, and print a report to standard error.")
+    parser.add_argument('--trace', default=None, help="Also write every timed span to this trace file.")
+    args = parser.parse_args(argv)
+
+    def names(value):
+        return [name for name in value.split(',') if name]
+    boost = testCase.boost if args.boost is None else resolve_symbols(names(args.boost))
+    nerf  = testCase.nerf if args.nerf is None else resolve_symbols(names(args.nerf))
+    instrument = (args.instrument or args.trace is not None) and not Instrumentation.enabled()
+    if instrument:
+        Instrumentation.enable()
+    # Reuse fits saved by earlier runs, and save new ones for the next run
+    Stock.PERSIST_ANALYTICS = True
+    # Progress messages go to standard error so they never mix with the output
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run(resolve_symbols(names(args.universe)), horizons=args.years, boost=boost, nerf=nerf,
+                     limit=args.limit, min_share=args.min_share, mode=args.mode, offline=args.offline,
+                     max_age_days=args.max_age_days, workers=args.workers)
+    text = result.to_json() if args.format == 'json' else result.to_csv()
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w', newline='') as file:
+            file.write(text)
+    if instrument:
+        print(Instrumentation.report(), file=sys.stderr)
+    if args.trace is not None:
+        Instrumentation.write_trace(args.trace)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
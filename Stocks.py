@@ -1,7 +1,32 @@
+def _memoized(days_per_year=365.25, inclusive=False):
+    """
+    Memoize an analytic of a Stock which takes a number of years, using the Stock's analytics cache.
+
+    The result is keyed by the version of the history and the first row of the window the years select, so it is
+    recomputed whenever the history changes or the window moves past a Snapshot. On disk it is keyed by the years, as
+    the first row moves with the clock, so later sessions reuse it for as long as the history is unchanged.
+
+    Parameters:
+        days_per_year, inclusive: How the analytic selects its window, as passed to Stock.window.
+    """
+    import functools
+    def decorate(method):
+        @functools.wraps(method)
+        def memoized(self, years=10):
+            start = self.window(years, days_per_year=days_per_year, inclusive=inclusive).start
+            return self._Memoized((method.__name__, start), lambda: method(self, years),
+                                  persist=(method.__name__, float(years)))
+        return memoized
+    return decorate
+
+
 class Stock:
     """A class to represent a publicly traded stock."""
+    import collections
+    import Instrumentation
     import pandas
     import datetime
+    import numpy
 
     @property
     def symbol(self):
@@ -32,12 +57,25 @@ class Stock:
 
     @property
     def history(self):
-        """(List[Stock.Snapshot]) The known history of this Stock."""
+        """(History) The known history of this Stock. Indexing it yields Snapshot views of single rows."""
         return self._history
     @history.setter
     def history(self, history):
-        """Set the history of this Stock."""
+        """Set the history of this Stock from a History or a list of Stock.Snapshot."""
+        from History import History
+        if not isinstance(history, History):
+            history = History.from_snapshots(history)
         self._history = history
+        self._partial = None
+        self.cache_clear()
+
+    @property
+    def partial_since(self):
+        """
+        (numpy.datetime64) Where the history starts, if it was parsed with ParseCSV(since=...) and the rest of the
+        file has not been read yet. None if the history is complete.
+        """
+        return None if self._partial is None else self._partial[1]
 
     @property
     def pe_ratio(self):
@@ -92,6 +130,24 @@ class Stock:
             self.dividend       = dividend
             self.annualDividend = annualDividend
 
+    class LoadResult:
+        """
+        The outcome of loading one symbol with Stock.LoadMany.
+
+        Members:
+            symbol: The symbol which was requested.
+            stock (Stock): The loaded Stock, or None if loading failed.
+            error (Exception): Why loading failed, or None if it succeeded.
+        """
+        symbol : str
+        stock  : object
+        error  : Exception
+
+        def __init__(self, symbol, stock=None, error=None):
+            self.symbol = symbol
+            self.stock  = stock
+            self.error  = error
+
     def __init__(self, symbol, name=None, market=None, history=None):
         """
         Create a new Stock with the given symbol.
@@ -100,19 +156,27 @@ class Stock:
             symbol: The symbol used to identify this Stock on the exchange market.
             name: The name of the company represented by this Stock.
             market: The name of the market this Stock is traded in.
-            history ([Stock.Snapshot]): The known history of this Stock.
+            history (History or [Stock.Snapshot]): The known history of this Stock.
         """
+        from History import History
         self._symbol = symbol
         self._name = name
         if name == None:
             self._name = symbol
         self._market = market
+        self._pe_ratio = None
+        self._short_percent_of_float = None
+        self._memo = Stock.collections.OrderedDict()
+        self._memo_hits   = 0
+        self._memo_misses = 0
+        self._fingerprint = None
+        self._partial     = None
         if history != None:
-            self._history = history
+            self.history = history
         else:
-            self._history = []
+            self._history = History()
         
-    def AddSnapshot(self, price, date=datetime.datetime.now(), dividend=0., annualDividend=0.):
+    def AddSnapshot(self, price, date=datetime.datetime.now(), dividend=0., annualDividend=0., keep='last'):
         """
         Add a Snapshot to the Stock's history.
 
@@ -120,65 +184,379 @@ class Stock:
             price (USD): The cost of one unit of Stock at this time.
             date: The timestamp for this Snapshot.
             annualDividend (USD/year): The total dividends paid in one year.
+            keep ("last" or "first"): Whether a Snapshot on a date already in the history replaces the old one.
+        """
+        self._history.append(price=price, date=date, dividend=dividend, annualDividend=annualDividend, keep=keep)
+
+    def AddSnapshots(self, dates, prices, dividends=None, annualDividends=None, keep='last'):
+        """
+        Add many Snapshots to the Stock's history at once, given as whole columns.
+
+        Parameters:
+            dates: Sequence of timestamps.
+            prices (USD): Sequence of prices, one per date.
+            dividends (USD): Sequence of dividends paid on each date. Defaults to zeros.
+            annualDividends (USD/year): Sequence of the total dividends paid in one year. Defaults to zeros.
+            keep ("last" or "first"): Which Snapshot to keep when a date appears more than once.
         """
-        self._AddSnapshot(self.Snapshot(price=price, date=date, dividend=dividend, annualDividend=annualDividend))
+        self._history.extend(dates=dates, prices=prices, dividends=dividends, annualDividends=annualDividends, keep=keep)
         
-    def _AddSnapshot(self, snapshot):
+    def _AddSnapshot(self, snapshot, keep='last'):
         """
         Add a Snapshot to the Stock's history.
 
         Parameters:
             snapshot (Stock.Snapshot): The Snapshot to add to this Stock's history.
+            keep ("last" or "first"): Whether a Snapshot on a date already in the history replaces the old one.
         """
-        if self._history.count(snapshot) == 0:
-            self._history.append(snapshot)
+        self.AddSnapshot(price=snapshot.price, date=snapshot.date, dividend=snapshot.dividend, annualDividend=snapshot.annualDividend, keep=keep)
             
-    def Update(self):
-        """Updates the Stock's history based on the most recent data from the yfinance API."""
-        print(f"Updating {self.name} from yfinance API...")
-        import yfinance as yf
-        import datetime
-        stock = yf.Ticker(self._symbol)
-        if (self.name == None or self.name == self.symbol) and stock.info is not None:
-            if "shortName" in stock.info:
-                self.name = stock.info['shortName']
-        yhistory = stock.history(period="max")
+    INCREMENTAL_PRICE_TOLERANCE = 1e-6
+
+    @Instrumentation.timed("Stock.Update")
+    def Update(self, provider=None, incremental=False):
+        """
+        Updates the Stock's history based on the most recent market data.
+
+        Parameters:
+            provider (MarketData.Provider): Where to get the data. Defaults to the yfinance API.
+            incremental (bool): Only fetch data newer than the latest Snapshot already in the history. Falls back to
+                the full history when there is no history yet, or when the provider's price on the latest known date
+                no longer matches ours (yfinance re-adjusts past prices after splits and dividends).
+        """
+        import numpy
+        import Instrumentation
+        from History import History
+        from MarketData import YfinanceProvider
+        if provider is None:
+            provider = YfinanceProvider()
+        print(f"Updating {self.name} from {provider.name}...")
+        with Instrumentation.span("Stock.Update fetch", self._symbol):
+            info = provider.info(self._symbol)
+            if self.name == None or self.name == self.symbol:
+                if "shortName" in info:
+                    self.name = info['shortName']
+            yhistory = None
+            if incremental and len(self._history) != 0:
+                yhistory = self._FetchIncrement(provider)
+            if yhistory is None:
+                yhistory = provider.history(self._symbol)
         print(yhistory)
+        Instrumentation.count("rows ingested", len(yhistory), self._symbol)
 
-        dividends = []
-        for date, row in yhistory.iterrows():
-            dividend_today = row['Dividends']
-            dividends.append((date, dividend_today))
-            if dividend_today != 0.:
-                while date - dividends[0][0] > datetime.timedelta(days=360):
-                    dividends.remove(dividends[0])
-            else:
-                while date - dividends[0][0] > datetime.timedelta(days=370):
-                    dividends.remove(dividends[0])
+        dates         = History.to_datetime64_array(yhistory.index)
+        prices        = yhistory['Open'].to_numpy(dtype=numpy.float64)
+        #prices        = yhistory['Close'].to_numpy(dtype=numpy.float64)
+        dividendsPaid = yhistory['Dividends'].to_numpy(dtype=numpy.float64)
 
-            annualDividend = 0.
-            for dividend in dividends:
-                annualDividend += dividend[1]
-                
-            self.AddSnapshot(price=row['Open'], date=date, dividend=dividend_today, annualDividend=annualDividend)
-            #self.AddSnapshot(price=row['Close'], date=date, annualDividend=annualDividend)
+        # Replay the known rows inside the trailing dividend window so the annual dividends continue across the seam
+        seed = 0
+        if len(dates) != 0 and len(self._history) != 0 and dates[0] > self._history.dates[-1]:
+            self._Cover(self._history.dates[-1] - History.DIVIDEND_WINDOW_LONG)
+            seed = len(self._history) - int(numpy.searchsorted(self._history.dates, self._history.dates[-1] - History.DIVIDEND_WINDOW_LONG))
+        annualDividends = History.trailing_annual_dividends(numpy.concatenate((self._history.dates[len(self._history) - seed:], dates)),
+                                                    numpy.concatenate((self._history.dividends[len(self._history) - seed:], dividendsPaid)))[seed:]
+        self.AddSnapshots(dates=dates, prices=prices, dividends=dividendsPaid, annualDividends=annualDividends)
 
         try:
-            self.short_percent_of_float = stock.info['shortPercentOfFloat']
+            self.short_percent_of_float = info['shortPercentOfFloat']
         except(KeyError):
             self.short_percent_of_float = 0.
         try:
-            self.pe_ratio = stock.info['forwardPE']
+            self.pe_ratio = info['forwardPE']
         except(KeyError, TypeError):
             self.pe_ratio = float('inf')
 
         print(f"History for {self.name} updated.")
 
-    def GetInfo(self):
-        """ Retrieve the stock info from yFinance API """
-        import yfinance as yf
-        return yf.Ticker(self._symbol).get_info()
+    def _FetchIncrement(self, provider):
+        """
+        Fetch only the rows newer than the latest Snapshot in the history.
+
+        The latest known date is fetched as well, and its price is compared against ours to make sure the provider
+        has not re-adjusted past prices since they were cached.
+
+        Returns:
+            The provider's price history frame after the latest known date, or None if a full download is needed.
+        """
+        import math
+        from History import History
+        last  = self._history.dates[-1]
+        frame = provider.history(self._symbol, start=last.item())
+        dates = History.to_datetime64_array(frame.index)
+        overlap = dates == last
+        if not overlap.any() or not math.isclose(float(frame['Open'][overlap].iloc[0]), float(self._history.prices[-1]),
+                                                  rel_tol=Stock.INCREMENTAL_PRICE_TOLERANCE):
+            print(f"Known prices for {self.symbol} no longer match {provider.name}. Downloading the full history.")
+            return None
+        return frame[dates > last]
+
+    def RecomputeAnnualDividends(self):
+        """Recompute the annualized dividends of the whole history from the dividends it already holds."""
+        from History import History
+        self.LoadFullHistory()
+        self._history.annualDividends[:] = History.trailing_annual_dividends(self._history.dates, self._history.dividends)
+        self._history.mark_modified(0)
+
+    def GetInfo(self, provider=None):
+        """ Retrieve the stock info from yFinance API, or from the given MarketData.Provider """
+        from MarketData import YfinanceProvider
+        if provider is None:
+            provider = YfinanceProvider()
+        return provider.info(self._symbol)
+
+    ANALYTICS_CACHE_SIZE = 64
+
+    CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+    # Off by default, so scripts using the analytics never write to Cache/. The screener entry points turn it on.
+    PERSIST_ANALYTICS = False
 
+    def _Memoized(self, key, compute, persist=True):
+        """
+        Look up an analytic in this Stock's cache, computing and storing it on a miss.
+
+        The cache holds the ANALYTICS_CACHE_SIZE most recently used results. Results are keyed by the version of the
+        history as well as the given key, so any change to the history invalidates them. Exceptions are not cached.
+        While PERSIST_ANALYTICS is set, persistent results are also kept on disk by DerivedCache, so later sessions
+        reuse them for as long as the history is unchanged.
+
+        Parameters:
+            key (tuple): Identifies the analytic and everything its result depends on besides the history.
+            compute: Called with no arguments to compute the result on a miss.
+            persist: Whether the result may be kept on disk, under key. A tuple keeps it on disk under that key
+                instead, for keys holding row indexes which move with the clock while the history stays the same.
+                The key on disk and the result must be representable in JSON.
+        """
+        value = self._MemoLookup(key, persist)
+        if value is None:
+            value = compute()
+            self._MemoStore(key, value, persist)
+        return value
+
+    def _MemoLookup(self, key, persist=True):
+        """The result stored for a key in this Stock's cache, or on disk, or None if there is none. See _Memoized."""
+        import Instrumentation
+        memoKey = (self._history.version,) + key
+        try:
+            value = self._memo[memoKey]
+        except(KeyError):
+            value = None
+            if persist and Stock.PERSIST_ANALYTICS and len(self._history) != 0:
+                from DerivedCache import DerivedCache
+                value = DerivedCache.Open().get(self._symbol, self._Fingerprint(), Stock._DerivedKey(key, persist))
+                Instrumentation.count("derived cache hits" if value is not None else "derived cache misses", 1, self._symbol)
+            if value is None:
+                self._memo_misses += 1
+                Instrumentation.count("analytics cache misses", 1, self._symbol)
+                return None
+            self._memo[memoKey] = value
+            if len(self._memo) > Stock.ANALYTICS_CACHE_SIZE:
+                self._memo.popitem(last=False)
+        self._memo.move_to_end(memoKey)
+        self._memo_hits += 1
+        Instrumentation.count("analytics cache hits", 1, self._symbol)
+        return value
+
+    def _MemoStore(self, key, value, persist=True):
+        """Store the result for a key in this Stock's cache, and on disk while PERSIST_ANALYTICS is set."""
+        self._memo[(self._history.version,) + key] = value
+        if len(self._memo) > Stock.ANALYTICS_CACHE_SIZE:
+            self._memo.popitem(last=False)
+        if persist and Stock.PERSIST_ANALYTICS and len(self._history) != 0:
+            from DerivedCache import DerivedCache
+            DerivedCache.Open().put(self._symbol, self._Fingerprint(), Stock._DerivedKey(key, persist), value)
+
+    @staticmethod
+    def _DerivedKey(key, persist=True):
+        """The key of a result in DerivedCache, from the key and persist arguments of _Memoized."""
+        import json
+        return json.dumps(list(persist if isinstance(persist, tuple) else key))
+
+    def _Fingerprint(self):
+        """The DerivedCache fingerprint of the history, computed once per version of the history."""
+        from DerivedCache import DerivedCache
+        version = self._history.version
+        if self._fingerprint is None or self._fingerprint[0] != version:
+            self._fingerprint = (version, DerivedCache.fingerprint(self))
+        return self._fingerprint[1]
+
+    def cache_info(self):
+        """(Stock.CacheInfo) The hits, misses, maximum size and current size of this Stock's analytics cache."""
+        return Stock.CacheInfo(self._memo_hits, self._memo_misses, Stock.ANALYTICS_CACHE_SIZE, len(self._memo))
+
+    def cache_clear(self):
+        """Empty this Stock's analytics cache and reset its counters. Results kept on disk are not affected."""
+        self._memo = Stock.collections.OrderedDict()
+        self._fingerprint = None
+        self._memo_hits   = 0
+        self._memo_misses = 0
+
+    def index_at(self, date, side='left'):
+        """
+        Find where a date falls in the history by bisection.
+
+        Parameters:
+            date (datetime): The date to look up.
+            side ("left" or "right"): "left" gives the index of the first Snapshot on or after date.
+                                      "right" gives the index of the first Snapshot after date.
+
+        Returns:
+            An index between 0 and len(history), inclusive.
+        """
+        import numpy
+        from History import History
+        self._Cover(date)
+        return int(numpy.searchsorted(self._history.dates, History.to_datetime64(date), side=side))
+
+    def _Cover(self, date):
+        """
+        Read the rest of a history parsed with ParseCSV(since=...) if date is before the rows parsed so far.
+
+        Parameters:
+            date (datetime): The earliest date about to be used, or None for the start of the history.
+        """
+        from History import History
+        if self._partial is not None and (date is None or History.to_datetime64(date) < self._partial[1]):
+            self.LoadFullHistory()
+
+    def window(self, years, as_of=None, days_per_year=365.25, inclusive=False):
+        """
+        The rows of the history within a number of years of a date.
+
+        Parameters:
+            years: How many years the window covers.
+            as_of (datetime): The end of the window. Defaults to now, which includes every Snapshot.
+            days_per_year: The length of a year in days.
+            inclusive: Whether a Snapshot exactly at the start of the window is included.
+
+        Returns:
+            slice of the history's rows, usable on the history itself or on any of its columns.
+        """
+        import datetime
+        latest = as_of is None
+        if latest:
+            as_of = datetime.datetime.now()
+        start = self.index_at(as_of - datetime.timedelta(days=days_per_year*years), side='left' if inclusive else 'right')
+        stop  = len(self._history) if latest else self.index_at(as_of, side='right')
+        return slice(min(start, stop), stop)
+
+    def dividends_between(self, start, end=None):
+        """
+        The total dividends paid between two dates, in logarithmic time.
+
+        Parameters:
+            start (datetime): The first date to include.
+            end (datetime): The last date to include. Defaults to the end of the history.
+
+        Returns:
+            The total dividends (USD) of the Snapshots dated from start to end, inclusive.
+        """
+        first = self.index_at(start)
+        stop  = len(self._history) if end is None else self.index_at(end, side='right')
+        return self._history.dividends_paid(first, stop)
+
+    def total_return_series(self, window=None):
+        """
+        The value of holding one unit of this Stock from the start of a window, with dividends kept as cash.
+
+        Parameters:
+            window (slice): The rows of the history to cover, as returned by window(). Defaults to the whole history.
+
+        Returns:
+            numpy array with one value (USD) per row of the window: the price plus the dividends paid since the first
+            row of the window, that row included.
+        """
+        if window is None:
+            self._Cover(None)
+        start, stop, _ = (window or slice(None)).indices(len(self._history))
+        return self._history.prices[start:stop] + self._history.cumulative_dividends(start, stop)
+
+    def rolling_total_yield(self, lag=200, start=None, end=None):
+        """
+        The total yield of every Snapshot relative to the Snapshot a fixed number of rows earlier: the change in
+        price plus the annualized dividend, as a percent of the earlier price.
+
+        The series is built for the whole history in one pass and kept in the analytics cache, so later queries only
+        select from it.
+
+        Parameters:
+            lag: How many rows back the reference Snapshot is.
+            start (datetime): The first date to include. Defaults to the start of the history.
+            end (datetime): The last date to include. Defaults to the end of the history.
+
+        Returns:
+            Tuple: (numpy array of dates, numpy array of total yields in percent). Snapshots whose reference price is
+            zero are left out.
+        """
+        import numpy
+        first, last = self._RowRange(start, end)
+        if first < lag and self._partial is not None:
+            # The reference Snapshots of the first rows are before the rows parsed so far
+            self.LoadFullHistory()
+            first, last = self._RowRange(start, end)
+        def compute():
+            rows = numpy.arange(lag, len(self._history))
+            past = self._history.prices[rows - lag]
+            rows = rows[past != 0.]
+            past = self._history.prices[rows - lag]
+            change = self._history.prices[rows] - past + self._history.annualDividends[rows]
+            return Stock._ReadOnly(rows, 100. * change / past)
+        rows, values = self._Memoized(('rolling_total_yield', lag), compute, persist=False)
+        first, last = numpy.searchsorted(rows, (first, last))
+        return self._history.dates[rows[first:last]], values[first:last]
+
+    def growth_and_dividend_series(self, start=None, end=None):
+        """
+        The annualized growth from every Snapshot to the latest one, and the dividend yield of every Snapshot.
+
+        The growth is discounted by 2% per year, and limited to 1% per day between the two Snapshots either way.
+        Both series are built for the whole history in one pass and kept in the analytics cache.
+
+        Parameters:
+            start (datetime): The first date to include. Defaults to the start of the history.
+            end (datetime): The last date to include, and the date of the Snapshot growth is measured to. Defaults to
+                the end of the history.
+
+        Returns:
+            Tuple: (numpy array of dates, numpy array of growths in percent per year, numpy array of dividend yields
+            in percent). Snapshots with a zero price, or less than a day before the latest Snapshot, are left out.
+        """
+        import numpy
+        first, last = self._RowRange(start, end)
+        def compute():
+            dates  = self._history.dates[:last]
+            prices = self._history.prices[:last]
+            day    = numpy.timedelta64(1, 'D')
+            daysAgo   = (dates[-1] - dates) // day
+            daysSince = (dates - dates[-1]) // day
+            rows   = numpy.flatnonzero((prices != 0.) & (daysAgo != 0))
+            daysAgo   = daysAgo[rows].astype(numpy.float64)
+            growth = 100. * (prices[-1] / prices[rows] - 1.) * 1.02 ** (daysSince[rows] / 365.25) / (daysAgo / 365.25)
+            growth = numpy.clip(growth, -daysAgo, daysAgo)
+            dividendYield = 100. * self._history.annualDividends[rows] / prices[rows]
+            return Stock._ReadOnly(rows, growth, dividendYield)
+        if last == 0:
+            return self._history.dates[:0], numpy.zeros(0), numpy.zeros(0)
+        rows, growth, dividendYield = self._Memoized(('growth_and_dividend_series', last), compute, persist=False)
+        first = numpy.searchsorted(rows, first)
+        return self._history.dates[rows[first:]], growth[first:], dividendYield[first:]
+
+    def _RowRange(self, start=None, end=None):
+        """The rows of the history dated from start to end, inclusive, as a (first, stop) pair of row indexes."""
+        self._Cover(start)
+        first = 0 if start is None else self.index_at(start)
+        stop  = len(self._history) if end is None else self.index_at(end, side='right')
+        return first, max(first, stop)
+
+    @staticmethod
+    def _ReadOnly(*arrays):
+        """Mark arrays kept in the analytics cache read-only, so callers cannot change them behind its back."""
+        for array in arrays:
+            array.flags.writeable = False
+        return arrays
+
+    @_memoized(days_per_year=365, inclusive=True)
     def AverageDividendPercent(self, years=10):
         """
         The average dividend yield over the specified period
@@ -189,18 +567,10 @@ class Stock:
         Returns:
             The average dividend yield percentage over the specified period
         """
-        nSamples = 0
-        dividendSum = 0.
-        import datetime
         import math
-        now = datetime.datetime.now()
-        for index in range(len(self._history)):
-            snapshot = self._history[-1 - index]
-            if now - snapshot.date > datetime.timedelta(days=365*years):
-                break
-            nSamples += 1
-            if not math.isnan(snapshot.annualDividend / snapshot.price):
-                dividendSum += snapshot.annualDividend / snapshot.price
+        recent = self.window(years, days_per_year=365, inclusive=True)
+        nSamples = recent.stop - recent.start
+        _, dividendSum, _ = self._history.yield_moments(recent.start, recent.stop)
         if nSamples == 0:
             return 0.
         avgDiv = 100. * dividendSum / nSamples
@@ -208,6 +578,7 @@ class Stock:
             return 0
         return avgDiv
 
+    @_memoized(days_per_year=365, inclusive=True)
     def DividendPercentUncertainty(self, years=10):
         '''
         The uncertainty in dividend yield over the specified period
@@ -219,18 +590,14 @@ class Stock:
             The average dividend yield percentage over the specified period
         '''
         average_dividend = self.AverageDividendPercent(years)
-        nSamples = 0
-        uncertainty = 0.
-        import datetime
         import math
-        now = datetime.datetime.now()
-        for index in range(len(self._history)):
-            snapshot = self._history[-1 - index]
-            if now - snapshot.date > datetime.timedelta(days=365*years):
-                break
-            nSamples += 1
-            if not math.isnan(snapshot.annualDividend / snapshot.price):
-                uncertainty += (snapshot.annualDividend / snapshot.price - average_dividend) ** 2
+        recent = self.window(years, days_per_year=365, inclusive=True)
+        nSamples = recent.stop - recent.start
+        # The sum of (yield - average_dividend) ** 2, from the spread of the yields around their own mean
+        count, total, spread = self._history.yield_moments(recent.start, recent.stop)
+        uncertainty = 0.
+        if count != 0:
+            uncertainty = spread + count * (total / count - average_dividend) ** 2
         if nSamples == 0:
             return average_dividend
         uncertainty /= nSamples - 1.
@@ -239,6 +606,28 @@ class Stock:
             return average_dividend
         return uncertainty
 
+    def DividendYieldStatistics(self, years=10):
+        """
+        The mean and sample standard deviation of the dividend yield over the specified period.
+
+        Unlike AverageDividendPercent and DividendPercentUncertainty, days without a known yield are left out of both,
+        and the deviation is measured around the mean yield in the same units.
+
+        Parameters:
+            years: The number of years into the past to average over.
+
+        Returns:
+            Tuple: The mean dividend yield and its standard deviation, both in percent.
+        """
+        import math
+        recent = self.window(years, days_per_year=365, inclusive=True)
+        count, total, spread = self._history.yield_moments(recent.start, recent.stop)
+        if count == 0:
+            return (0., 0.)
+        if count == 1:
+            return (100. * total, 0.)
+        return (100. * total / count, 100. * math.sqrt(spread / (count - 1.)))
+
     def GrowthPercent(self, years=10):
         """
         The total growth over the specified period
@@ -250,16 +639,14 @@ class Stock:
             The total growth over the specified period in percent.
         """
         pastPrice = 0.
-        import datetime
-        today = datetime.datetime.now()
-        for index in range(0, len(self.history) - 1):
-            if today - self.history[index].date < datetime.timedelta(days=365*years):
-                pastPrice = self.history[index].price
-                break
+        index = self.window(years, days_per_year=365).start
+        if index < len(self._history) - 1:
+            pastPrice = float(self._history.prices[index])
         if pastPrice == 0.:
             return 0.
-        return 100. * (self.history[-1].price - lastYear) / lastYear
+        return 100. * (self.history[-1].price - pastPrice) / pastPrice
 
+    @_memoized()
     def GrowthAPR(self, years=10):
         """
         The growth over the specified period expressed as APR.
@@ -268,20 +655,15 @@ class Stock:
             year: The number of years into the past to compare against.
 
         Returns:
-            The effective APR over the specified period in percent.
+            The effective APR over the specified period in percent. 0 where the period starts at a zero price.
         """
         pastPrice = self.history[-1].price
-        import datetime
-        today = datetime.datetime.now()
         pastDate = self.history[-1].date
-        # TODO: This is an inefficient way to look up a specific date
-        for index in range(0, len(self.history) - 1):
-            if today - self.history[index].date < datetime.timedelta(days=365.25*years):
-                # Assuming the stock data is in chronological order, the first result more recent than X years
-                # is a good enough approximation
-                pastPrice = self.history[index].price
-                pastDate = self.history[index].date
-                break
+        index = self.window(years).start
+        if index < len(self._history) - 1:
+            # The first Snapshot more recent than X years is a good enough approximation
+            pastPrice = self.history[index].price
+            pastDate = self.history[index].date
         if pastPrice == 0.:
             return 0.
         n_years = (self.history[-1].date - pastDate).days / 365.25
@@ -297,59 +679,210 @@ class Stock:
             year: The number of years into the past to compare against.
 
         Returns:
-            Tuple: The effective APR over the specified period, and associated uncertainy. Both in percent.
+            Tuple: The effective APR over the specified period, and associated uncertainy. Both in percent. As in
+            GrowthAPR, the APR is 0 where the period starts at a zero price. The uncertainty is NaN or infinite where any
+            of the daily changes sampled every 20 days starts at a zero price.
         """
-        import math, datetime
+        import math
+        import numpy
 
         average_annual = self.GrowthAPR(years) / 100.
         average_daily = math.pow(1 + average_annual, 1 / 365) - 1.
         
-        i = 0
-        today = datetime.datetime.now()
-        while i < len(self.history):
-            if today - self.history[i].date < datetime.timedelta(days=365.25*years):
-                break
-            i += 1
-        uncertainty = 0.
         filter_days = 20
-        n_samples = 0
-        while i < len(self.history):
-            today = self.history[i].price
-            previous = self.history[i - 1].price
+        samples = numpy.arange(self.window(years).start, len(self._history), filter_days)
+        today = self._history.prices[samples]
+        previous = self._history.prices[samples - 1]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
             change = (today - previous) / previous
-            uncertainty += ((1. + change) ** (1 / filter_days) - (1. + average_daily)) ** 2
-            n_samples += 1
-            i += filter_days
+            uncertainty = float(numpy.sum(((1. + change) ** (1 / filter_days) - (1. + average_daily)) ** 2))
+        n_samples = len(samples)
         uncertainty /= n_samples - 1.
         uncertainty = math.sqrt(uncertainty)
         uncertainty *= 365.25 * (1. + average_annual)
 
         return (100. * average_annual, 100. * uncertainty)
 
-    def get_apr_fit(self, years=10., plot=False):
+    @Instrumentation.timed("Stock.get_apr_fit")
+    def get_apr_fit(self, years=10., plot=False, mode='coarse'):
         '''
         Get a curve fitted to the data with the form y = y_0 * (1 + rate) ^ t where "t" is the number of years from today
+
+        Parameters:
+            years: The number of years into the past to fit.
+            plot: Whether to plot the fit against the data.
+            mode ("coarse" or "exhaustive"): How AprFit searches for the basis point of the curve.
+
+        Fits are kept in this Stock's analytics cache. A cached fit is moved to the current time by shifting t_0. On
+        disk they are keyed by years and mode rather than by the rows of the window, so later sessions reuse a fit for
+        as long as the history is unchanged, even though the start of the window moves with the clock.
         '''
         import AprFit, datetime
-        t               = []
-        y               = []
-        total_dividends = 0.
+        import numpy
         today = datetime.datetime.now()
-        i = 0
-        while i < len(self.history):
-            if today - self.history[i].date < datetime.timedelta(days=365.25*years):
-                break
-            i += 1
-        while i < len(self.history):
-            total_dividends += self.history[i].dividend
-            t.append((self.history[i].date - today).total_seconds() / 31557600.)
-            y.append(self.history[i].price + total_dividends)
-            i += 1
-        apr_fit = AprFit.AprFit(t, y)
+        now   = numpy.datetime64(today, 'us')
+        recent = self.window(years, as_of=today)
+        dates = self._history.dates
+        def inputs():
+            microseconds = (dates[recent] - now).astype(numpy.int64)
+            t = (microseconds / 1e6 / 31557600.).tolist()
+            y = self.total_return_series(recent).tolist()
+            return t, y
+        stored = self._Memoized(('get_apr_fit', recent.start, recent.stop, mode),
+                                lambda: Stock._StoredFit(AprFit.AprFit(*inputs(), mode=mode), now),
+                                persist=Stock._FitDerivedKey(years, mode))
+        apr_fit = Stock._RebaseFit(stored, now)
         if plot:
-            apr_fit.plot(t, y)
+            apr_fit.plot(*inputs())
+        return apr_fit
+
+    @staticmethod
+    def _FitDerivedKey(years, mode):
+        """The DerivedCache key of a fit by get_apr_fit or get_apr_fits. The fingerprint adds the history."""
+        return ('get_apr_fit', float(years), mode)
+
+    @staticmethod
+    def _StoredFit(apr_fit, now):
+        """
+        An AprFit in the form kept in the analytics cache.
+
+        Returns:
+            List: [when the fit was made in microseconds since the epoch, rate, t_0, y_0, stdev].
+        """
+        import numpy
+        return [int(now.astype('datetime64[us]').astype(numpy.int64)),
+                float(apr_fit.rate), float(apr_fit.t_0), float(apr_fit.y_0), float(apr_fit.stdev)]
+
+    @staticmethod
+    def _RebaseFit(stored, now):
+        """
+        An AprFit from the analytics cache, with t_0 measured from now instead of from when it was fitted.
+
+        Parameters:
+            stored: The fit as returned by _StoredFit.
+            now (numpy.datetime64): The time t is measured from.
+        """
+        import AprFit
+        import numpy
+        fitted, rate, t_0, y_0, stdev = stored
+        elapsed = fitted - int(now.astype('datetime64[us]').astype(numpy.int64))
+        apr_fit = AprFit.AprFit.__new__(AprFit.AprFit)
+        apr_fit.rate  = rate
+        apr_fit.t_0   = t_0 + elapsed / 1e6 / 31557600. if elapsed else t_0
+        apr_fit.y_0   = y_0
+        apr_fit.stdev = stdev
         return apr_fit
 
+    @staticmethod
+    @Instrumentation.timed("Stock.get_apr_fits")
+    def get_apr_fits(stocks, years=10., mode='coarse'):
+        '''
+        Fit curves to many Stocks, the same way as get_apr_fit. The Stocks which are not cached yet are fitted one
+        after another by AprFit.fit_many.
+
+        Parameters:
+            stocks ([Stock]): The Stocks to fit.
+            years: The number of years into the past to fit.
+            mode ("coarse" or "exhaustive"): How AprFit searches for the basis point of each curve.
+
+        Returns:
+            AprFit.AprFitBatch with one fit per Stock, in the same order as stocks.
+
+        Fits already in a Stock's analytics cache, in memory or on disk, are reused, and new fits are added to it, so
+        get_apr_fit and get_apr_fits share their results and unchanged histories are not refitted in later sessions.
+        '''
+        import AprFit, datetime
+        import numpy
+        from DerivedCache import DerivedCache
+        today = datetime.datetime.now()
+        now   = numpy.datetime64(today, 'us')
+        results = AprFit.AprFitBatch(len(stocks))
+        missing = []
+        times   = []
+        values  = []
+        for index, stock in enumerate(stocks):
+            recent  = stock.window(years, as_of=today)
+            history = stock._history
+            key     = ('get_apr_fit', recent.start, recent.stop, mode)
+            stored  = stock._MemoLookup(key, Stock._FitDerivedKey(years, mode))
+            if stored is not None:
+                results.set(index, Stock._RebaseFit(stored, now))
+                continue
+            missing.append((index, key))
+            microseconds = (history.dates[recent] - now).astype(numpy.int64)
+            times.append(microseconds / 1e6 / 31557600.)
+            values.append(stock.total_return_series(recent))
+        fits = AprFit.AprFit.fit_many(times, values, mode=mode)
+        for position, (index, key) in enumerate(missing):
+            if fits.errors[position] is not None:
+                results.errors[index] = fits.errors[position]
+                continue
+            apr_fit = fits.fit(position)
+            stocks[index]._MemoStore(key, Stock._StoredFit(apr_fit, now), Stock._FitDerivedKey(years, mode))
+            results.set(index, apr_fit)
+        if Stock.PERSIST_ANALYTICS:
+            DerivedCache.Open().save()
+        return results
+
+    SWEEP_HORIZONS = (1, 2, 3, 5, 10, 20, 30)
+
+    @staticmethod
+    @Instrumentation.timed("Stock.sweep")
+    def sweep(stocks, horizons=SWEEP_HORIZONS, mode='coarse'):
+        '''
+        Evaluate the APR fit, growth and dividend yield of many Stocks over several lookback windows at once.
+
+        The times of each history are computed once and shared by every horizon, as are the running dividend totals
+        kept by the history, and every fit is done by one AprFit.fit_many call.
+
+        Parameters:
+            stocks ([Stock]): The Stocks to evaluate.
+            horizons: The numbers of years into the past to evaluate over.
+            mode ("coarse" or "exhaustive"): How AprFit searches for the basis point of each curve.
+
+        Returns:
+            pandas.DataFrame with one row per Stock and horizon, in the order given, with the columns:
+                symbol, years: The Stock and horizon of the row.
+                rate, t_0, y_0, stdev: The APR fit, as in get_apr_fit. NaN if the fit failed.
+                fit_error: Why the fit failed, or None.
+                growth_apr, growth_uncertainty: From GrowthAPRWithUncertainty, in percent.
+                dividend_percent, dividend_uncertainty: From AverageDividendPercent and DividendPercentUncertainty.
+        '''
+        import AprFit, datetime, math
+        import numpy, pandas
+        today  = datetime.datetime.now()
+        origin = numpy.datetime64(today, 'us')
+        times  = []
+        values = []
+        rows   = []
+        for stock in stocks:
+            stock._Cover(today - datetime.timedelta(days=365.25 * max(horizons, default=0)))
+            history = stock._history
+            t = (history.dates - origin).astype(numpy.int64) / 1e6 / 31557600.
+            for years in horizons:
+                recent = stock.window(years, as_of=today)
+                times.append(t[recent])
+                values.append(stock.total_return_series(recent))
+                try:
+                    growth, uncertainty = stock.GrowthAPRWithUncertainty(years)
+                except(ArithmeticError):
+                    growth, uncertainty = math.nan, math.nan
+                rows.append({'symbol'               : stock.symbol,
+                             'years'                : years,
+                             'growth_apr'           : growth,
+                             'growth_uncertainty'   : uncertainty,
+                             'dividend_percent'     : stock.AverageDividendPercent(years),
+                             'dividend_uncertainty' : stock.DividendPercentUncertainty(years)})
+        fits  = AprFit.AprFit.fit_many(times, values, mode=mode)
+        table = pandas.DataFrame(rows, columns=['symbol', 'years', 'growth_apr', 'growth_uncertainty',
+                                                'dividend_percent', 'dividend_uncertainty'])
+        table.insert(2, 'rate', fits.rate)
+        table.insert(3, 't_0', fits.t_0)
+        table.insert(4, 'y_0', fits.y_0)
+        table.insert(5, 'stdev', fits.stdev)
+        table.insert(6, 'fit_error', [None if error is None else str(error) for error in fits.errors])
+        return table
+
     @staticmethod
     def FromYfinance(symbol):
         """
@@ -362,67 +895,371 @@ class Stock:
         stock.Update()
         return stock
     
-    def SaveToCSV(self):
-        """Save this stock to a CSV file."""
-        import csv 
-        csvfile = open(f"Cache/{self.symbol}.csv", "w", newline='')
-        writer = csv.writer(csvfile, delimiter=',')
-        writer.writerow([self.symbol, self.name, self.market])
-        writer.writerow(['Latest P/E Ratio:', self.pe_ratio])
-        writer.writerow(['Short Percent of Float:', self.short_percent_of_float])
-        writer.writerow(['Date', 'Price', 'Dividend', 'Annualized Dividend'])
-        for snapshot in self._history:
-            writer.writerow([snapshot.date.strftime("%m/%d/%Y"), snapshot.price, snapshot.dividend, snapshot.annualDividend])
-        csvfile.close()
-        print(f"{self.name} saved to /Cache/{self.symbol}.csv")
+    @Instrumentation.timed("Stock.SaveToCSV")
+    def SaveToCSV(self, mode='auto'):
+        """
+        Save this stock to a CSV file.
+
+        Parameters:
+            mode ("auto", "append" or "rewrite"):
+                "append" only writes the Snapshots which are newer than the file. It needs the file to be unchanged
+                since this Stock was loaded from it or last saved to it, with the same header fields.
+                "rewrite" writes the whole file to a temporary file and renames it into place, so an interrupted save
+                never leaves a truncated file behind.
+                "auto" appends when it can and rewrites otherwise.
+        """
+        import csv, os
+        import Instrumentation
+        from CacheManifest import CacheManifest
+        self.LoadFullHistory()
+        path     = f"Cache/{self.symbol}.csv"
+        manifest = CacheManifest.Open()
+        appendFrom = None
+        if mode != 'rewrite':
+            appendFrom = self._AppendableFrom(manifest.get(self.symbol), path)
+        if mode == 'append' and appendFrom == None:
+            raise Exception(f"Cannot append to {path}: it does not match this Stock's history and header.")
+
+        if appendFrom == None:
+            temporary = f"{path}.tmp"
+            csvfile = open(temporary, "w", newline='')
+            writer = csv.writer(csvfile, delimiter=',')
+            writer.writerows(self._CSVHeader())
+            writer.writerow(['Date', 'Price', 'Dividend', 'Annualized Dividend'])
+            csvfile.write(''.join(self._CSVRows(0, len(self._history))))
+            # On disk before the rename, so a crash cannot leave an empty or truncated file in its place
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+            csvfile.close()
+            os.replace(temporary, path)
+            Instrumentation.count("rows written", len(self._history), self.symbol)
+            print(f"{self.name} saved to /Cache/{self.symbol}.csv")
+        else:
+            # One write of whole rows, after making sure the file ends on a complete row
+            csvfile = open(path, "a", newline='')
+            csvfile.write(''.join(self._CSVRows(appendFrom, len(self._history))))
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+            csvfile.close()
+            Instrumentation.count("rows written", len(self._history) - appendFrom, self.symbol)
+            print(f"{len(self._history) - appendFrom} new Snapshots of {self.name} appended to /Cache/{self.symbol}.csv")
+        self._history.mark_clean()
+        manifest.record(self)
+
+    def _CSVHeader(self):
+        """The header rows of this Stock's CSV file, as the strings written to it."""
+        def field(value):
+            return '' if value is None else str(value)
+        return [[field(self.symbol), field(self.name), field(self.market)],
+                ['Latest P/E Ratio:', field(self.pe_ratio)],
+                ['Short Percent of Float:', field(self.short_percent_of_float)]]
+
+    def _CSVRows(self, start, stop):
+        """
+        Format Snapshots for this Stock's CSV file.
+
+        Parameters:
+            start: The first row of the history to format.
+            stop: The row of the history to stop at.
+
+        Returns:
+            [str] One line per Snapshot in the layout csv.writer produces, with dates in CSV_DATE_FORMAT.
+        """
+        import numpy
+        history = self._history
+        days = numpy.datetime_as_string(history.dates[start:stop], unit='D').tolist()
+        return [f"{day[5:7]}/{day[8:10]}/{day[0:4]},{price!r},{dividend!r},{annualDividend!r}\r\n"
+                for day, price, dividend, annualDividend in zip(days,
+                                                                history.prices[start:stop].tolist(),
+                                                                history.dividends[start:stop].tolist(),
+                                                                history.annualDividends[start:stop].tolist())]
+
+    def _AppendableFrom(self, entry, path):
+        """
+        How many Snapshots of this Stock are already in its CSV file, if SaveToCSV can append the rest.
+
+        Parameters:
+            entry (dict): The cache manifest entry for the file, or None if the file changed since it was recorded.
+            path: The CSV file.
+
+        Returns:
+            The number of Snapshots already in the file, or None if the file has to be rewritten.
+        """
+        from History import History
+        if entry == None or entry.get('header') != self._CSVHeader():
+            return None
+        rows = entry['rows']
+        if rows > self._history.clean_rows:
+            return None
+        if rows != 0 and self._history.dates[rows - 1] != History.to_datetime64(entry['last_date']):
+            return None
+        with open(path, 'rb') as file:
+            file.seek(0, 2)
+            if file.tell() != 0:
+                file.seek(-1, 2)
+                if file.read(1) != b'\n':
+                    return None
+        return rows
+
+    CSV_DATE_FORMAT = "%m/%d/%Y"
+    CSV_LABELS      = {'Date', 'Latest P/E Ratio:', 'Short Percent of Float:'}
+
+    def _ParseCSVLabel(self, row):
+        """
+        Apply a labelled header row from a cached CSV file to this Stock.
+
+        Parameters:
+            row ([str]): The fields of one CSV row.
+
+        Returns:
+            True if the row was a header row, False if it is a data row.
+        """
+        if row[0] == 'Latest P/E Ratio:':
+            try:
+                self.pe_ratio = float(row[1])
+                if self.pe_ratio == 0.:
+                    self.pe_ratio = float('inf')
+            except(ValueError):
+                self.pe_ratio = float('inf')
+        elif row[0] == 'Short Percent of Float:':
+            try:
+                self.short_percent_of_float = float(row[1])
+            except(ValueError):
+                self.short_percent_of_float = 0.
+        elif row[0] != 'Date':
+            return False
+        return True
+
+    @staticmethod
+    def _ParseCSVDates(symbol, dates):
+        """
+        Convert date strings from a cached CSV file to numpy.datetime64.
+
+        Dates in the fixed format written by SaveToCSV ("%m/%d/%Y") are converted in bulk. Anything else falls back
+        to dateutil one row at a time.
+
+        Parameters:
+            symbol: The symbol of the Stock being parsed, used for warnings.
+            dates ([str]): The date strings.
+
+        Returns:
+            Tuple: (numpy.datetime64[us] array of parsed dates, boolean array marking the rows which parsed).
+        """
+        import numpy
+        from History import History
+        count  = len(dates)
+        chars  = numpy.array(dates, dtype='U10').view(numpy.uint32).reshape(count, 10).astype(numpy.int64)
+        digits = chars - ord('0')
+        fixed  = numpy.fromiter(map(len, dates), dtype=numpy.int64, count=count) == 10
+        fixed &= (chars[:, 2] == ord('/')) & (chars[:, 5] == ord('/'))
+        fixed &= numpy.all((digits[:, [0, 1, 3, 4, 6, 7, 8, 9]] >= 0) & (digits[:, [0, 1, 3, 4, 6, 7, 8, 9]] <= 9), axis=1)
+        digits[~fixed] = 0
+        month  = digits[:, 0] * 10 + digits[:, 1]
+        day    = digits[:, 3] * 10 + digits[:, 4]
+        year   = digits[:, 6] * 1000 + digits[:, 7] * 100 + digits[:, 8] * 10 + digits[:, 9]
+        fixed &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+        months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+        parsed = (months.astype('datetime64[D]') + (day - 1)).astype(History.DATE_DTYPE)
+        # Day 31 of a 30 day month rolls over into the next month, so those rows are not in the fixed format
+        fixed &= parsed.astype('datetime64[M]') == months
+
+        valid = fixed.copy()
+        fallback = numpy.flatnonzero(~fixed)
+        if len(fallback) != 0:
+            import Instrumentation
+            from dateutil.parser import parse, _parser
+            Instrumentation.count("dates parsed by dateutil", len(fallback), symbol)
+            with Instrumentation.span("dateutil fallback", symbol):
+                for index in fallback:
+                    try:
+                        parsed[index] = History.to_datetime64(parse(dates[index]))
+                        valid[index]  = True
+                    except(_parser.ParserError):
+                        print(f"WARNING: Un-parsed row in {symbol}: {dates[index]}")
+        return parsed, valid
 
     @staticmethod
-    def ParseCSV(path):
+    @Instrumentation.timed("Stock.ParseCSV")
+    def ParseCSV(path, since=None):
         """
         Return Stock data from a CSV file.
 
+        The header block (symbol, P/E ratio, short percent of float) is read row by row and the numeric body is
+        converted in bulk.
+
         Parameters:
             path: Relative path to the CSV file to parse.
+            since (datetime): Only parse the Snapshots dated on or after this. The first of them is found by bisecting
+                the file, so older rows are never read. They are read on demand, when an analytic reaches before
+                since or the Stock is saved (see LoadFullHistory). Defaults to the whole history.
 
         Returns:
             Stock parsed from the given CSV file.
         """
 
-        import csv
-        csvfile = open(path, newline='')
-        reader = csv.reader(csvfile, delimiter=',')
+        import csv, locale
+        import numpy
+        import Instrumentation
+        from History import History
+        with open(path, 'rb') as csvfile:
+            if since is None:
+                text = csvfile.read()
+            else:
+                since = History.to_datetime64(since)
+                bodyStart, windowStart = Stock._CSVWindowStart(csvfile, since)
+                csvfile.seek(0)
+                text = csvfile.read(bodyStart)
+                csvfile.seek(windowStart)
+                text += csvfile.read()
+        lines = text.decode(locale.getpreferredencoding(False)).splitlines()
         stock = Stock(symbol=None)
+        if len(lines) == 0:
+            return stock
 
-        rowNum = 0
-        from dateutil.parser import parse, _parser
-        for row in reader:
-            if rowNum == 0:
-                stock.symbol = row[0]
-                stock.name = row[1]
-                stock.market = row[2]
-            elif row[0] == 'Latest P/E Ratio:':
-                try:
-                    stock.pe_ratio = float(row[1])
-                    if stock.pe_ratio == 0.:
-                        stock.pe_ratio = float('inf')
-                except(ValueError):
-                    stock.pe_ratio = float('inf')
-            elif row[0] == 'Short Percent of Float:':
-                try:
-                    stock.short_percent_of_float = float(row[1])
-                except(ValueError):
-                    stock.short_percent_of_float = 0.
-            elif row[0] != 'Date':
-                # Skip the header row
-                try:
-                    stock.AddSnapshot(price=float(row[1]), date=parse(row[0]), dividend=float(row[2]), annualDividend=float(row[3]))
-                except(_parser.ParserError):
-                    print(f"WARNING: Un-parsed row in {stock.symbol}: {row[0]}")
+        row = next(csv.reader(lines[:1], delimiter=','))
+        stock.symbol = row[0]
+        stock.name = row[1]
+        stock.market = row[2]
+
+        rowNum = 1
+        while rowNum < len(lines) and stock._ParseCSVLabel(lines[rowNum].split(',')):
             rowNum += 1
+        body = [line for line in lines[rowNum:] if line]
 
-        csvfile.close()
+        skipped = 0
+        cells = ','.join(body).split(',')
+        if len(cells) == 4 * len(body) and Stock.CSV_LABELS.isdisjoint(cells[0::4]):
+            columns = [cells[0::4], cells[1::4], cells[2::4], cells[3::4]]
+        else:
+            # Quoted fields or header rows inside the body. Fall back to reading it row by row.
+            columns = [[], [], [], []]
+            for row in csv.reader(body, delimiter=','):
+                if stock._ParseCSVLabel(row):
+                    continue
+                if len(row) < 4:
+                    # An interrupted append can leave a partial last row
+                    print(f"WARNING: Un-parsed row in {stock.symbol}: {','.join(row)}")
+                    skipped += 1
+                    continue
+                columns[0].append(row[0])
+                columns[1].append(row[1])
+                columns[2].append(row[2])
+                columns[3].append(row[3])
+
+        dates, valid = Stock._ParseCSVDates(stock.symbol, columns[0])
+        Instrumentation.count("rows parsed", int(numpy.count_nonzero(valid)), stock.symbol)
+        Instrumentation.count("rows skipped", skipped + len(valid) - int(numpy.count_nonzero(valid)), stock.symbol)
+        if since is not None:
+            inside = dates >= since
+            if windowStart != bodyStart or not numpy.all(inside[valid]):
+                stock._partial = (path, since)
+            valid &= inside
+        stock.AddSnapshots(dates           = dates[valid],
+                           prices          = numpy.array(columns[1], dtype=numpy.float64)[valid],
+                           dividends       = numpy.array(columns[2], dtype=numpy.float64)[valid],
+                           annualDividends = numpy.array(columns[3], dtype=numpy.float64)[valid])
+        stock._history.mark_clean()
         return stock
+
+    @staticmethod
+    def _CSVWindowStart(csvfile, since):
+        """
+        Find the first row of a cached CSV file dated on or after a date, by bisecting the file.
+
+        SaveToCSV writes rows in chronological order, so a few probes of single rows find the window. If a probe
+        hits a row which is not in the fixed date format, the rows cannot be trusted to be ordered and the whole body
+        is read instead.
+
+        Parameters:
+            csvfile: The CSV file, opened in binary mode.
+            since (numpy.datetime64): The first date to read.
+
+        Returns:
+            Tuple: (offset of the first row after the header, offset of the first row to read).
+        """
+        import datetime
+        from History import History
+        labels = {label.encode() for label in Stock.CSV_LABELS}
+        csvfile.seek(0)
+        csvfile.readline()
+        bodyStart = csvfile.tell()
+        while csvfile.readline().rstrip(b'\r\n').split(b',')[0] in labels:
+            bodyStart = csvfile.tell()
+        csvfile.seek(0, 2)
+        low, high = bodyStart, csvfile.tell()
+
+        def rowAt(offset):
+            """The offset of the first row starting at or after offset, and whether it is dated on or after since."""
+            csvfile.seek(max(offset, bodyStart + 1) - 1)
+            if offset > bodyStart:
+                csvfile.readline()
+            start = csvfile.tell()
+            line  = csvfile.readline()
+            if not line:
+                return start, True
+            date = datetime.datetime.strptime(line.split(b',')[0].decode('ascii'), Stock.CSV_DATE_FORMAT)
+            return start, History.to_datetime64(date) >= since
+
+        try:
+            while low < high:
+                middle = (low + high) // 2
+                if rowAt(middle)[1]:
+                    high = middle
+                else:
+                    low = middle + 1
+            return bodyStart, rowAt(low)[0]
+        except(ValueError):
+            return bodyStart, bodyStart
+
+    def LoadFullHistory(self):
+        """
+        Read the rows of the CSV file left out by ParseCSV(since=...), keeping every Snapshot added or changed since
+        it was parsed. Does nothing if the history is already complete.
+        """
+        if self._partial is None:
+            return
+        path, since = self._partial
+        print(f"Reading the history of {self.symbol} before {since.astype('datetime64[D]')} from {path}.")
+        window  = self._history
+        clean   = window.clean_rows
+        history = Stock.ParseCSV(path)._history
+        history.extend(dates           = window.dates[clean:],
+                       prices          = window.prices[clean:],
+                       dividends       = window.dividends[clean:],
+                       annualDividends = window.annualDividends[clean:])
+        self.history = history
     
+    def SaveToBinary(self):
+        """Save this stock to a binary cache file which can be memory-mapped by ParseBinary."""
+        self.LoadFullHistory()
+        self._history.save(f"Cache/{self.symbol}.bin", metadata={'symbol'                 : self.symbol,
+                                                                 'name'                   : self.name,
+                                                                 'market'                 : self.market,
+                                                                 'pe_ratio'               : self._pe_ratio,
+                                                                 'short_percent_of_float' : self._short_percent_of_float})
+
+    @staticmethod
+    @Instrumentation.timed("Stock.ParseBinary")
+    def ParseBinary(path):
+        """
+        Return Stock data from a binary cache file written by SaveToBinary.
+
+        The history is memory-mapped rather than parsed, so loading is nearly free and processes which load the same
+        file share its memory.
+
+        Parameters:
+            path: Relative path to the binary file to load.
+
+        Returns:
+            Stock loaded from the given binary file.
+        """
+        from History import History
+        history, metadata = History.load(path)
+        stock = Stock(symbol=metadata['symbol'], name=metadata['name'], market=metadata['market'], history=history)
+        stock.pe_ratio = metadata['pe_ratio']
+        stock.short_percent_of_float = metadata['short_percent_of_float']
+        return stock
+
     def SaveToJSON(self):
         """
         !NOT IMPLEMENTED! 
@@ -439,6 +1276,208 @@ class Stock:
 
         print("Warning: SaveToJSON not fully implemented.")
 
+    @staticmethod
+    def _LoadCached(symbol):
+        """
+        Load a Stock from the local cache, preferring the binary file when it is at least as new as the CSV file.
+        A CSV file without an up to date binary file is parsed and converted.
+
+        Parameters:
+            symbol: The symbol used to identify this Stock in exchange markets
+
+        Returns:
+            The cached Stock, or None if the symbol is not cached.
+        """
+        import os
+        from CacheManifest import CacheManifest
+        from History import History
+        csvPath    = f"Cache/{symbol}.csv"
+        binaryPath = f"Cache/{symbol}.bin"
+        stock      = None
+        if os.path.exists(binaryPath) and (not os.path.exists(csvPath) or os.path.getmtime(binaryPath) >= os.path.getmtime(csvPath)):
+            try:
+                print(f"Loading {symbol} from local binary cache.")
+                stock = Stock.ParseBinary(binaryPath)
+            except(ValueError, KeyError, OSError) as ex:
+                print(f"WARNING: Could not load {binaryPath}: {ex}")
+        if stock is None:
+            if not os.path.exists(csvPath):
+                return None
+            print(f"Parsing {symbol} from local drive.")
+            stock = Stock.ParseCSV(csvPath)
+            try:
+                stock.SaveToBinary()
+            except(OSError) as ex:
+                print(f"WARNING: Could not write {binaryPath}: {ex}")
+
+        # Index the symbol so the next freshness check does not need to load it
+        manifest = CacheManifest.Open()
+        entry = manifest.get(symbol)
+        if os.path.exists(csvPath) and entry is None and stock.symbol == symbol:
+            stock._history.mark_clean()
+            manifest.record(stock, csvPath)
+        elif entry is not None and entry['rows'] == len(stock.history) and \
+             (entry['rows'] == 0 or stock.history.dates[-1] == History.to_datetime64(entry['last_date'])):
+            # The binary file holds the same rows as the CSV file, so later saves can append to it
+            stock._history.mark_clean()
+        return stock
+
+    @staticmethod
+    def StaleSymbols(symbols, minDate=None):
+        """
+        List the symbols whose cached history is missing or older than minDate.
+
+        Freshness comes from the cache manifest. Only symbols the manifest does not know yet are loaded, once, to
+        index them.
+
+        Parameters:
+            symbols ([str]): The symbols to check.
+            minDate (datetime): The oldest acceptable date for the latest cached Snapshot.
+
+        Returns:
+            The symbols which need to be downloaded, in the given order.
+        """
+        from CacheManifest import CacheManifest
+        manifest = CacheManifest.Open()
+        stale = []
+        for symbol in symbols:
+            fresh = manifest.is_fresh(symbol, minDate)
+            if fresh is None:
+                stock = Stock._LoadCached(symbol)
+                fresh = stock is not None and len(stock.history) != 0 and (minDate == None or stock.history[-1].date >= minDate)
+            if not fresh:
+                stale.append(symbol)
+        manifest.save()
+        return stale
+
+    @staticmethod
+    def _NeedsConversion(symbol):
+        """Whether the symbol has a cached CSV file without an up to date binary file."""
+        import os
+        csvPath    = f"Cache/{symbol}.csv"
+        binaryPath = f"Cache/{symbol}.bin"
+        if not os.path.exists(csvPath):
+            return False
+        return not os.path.exists(binaryPath) or os.path.getmtime(binaryPath) < os.path.getmtime(csvPath)
+
+    @staticmethod
+    def _ConvertCSV(symbol):
+        """
+        Parse the cached CSV file of a symbol and write its binary cache file. Runs in LoadMany's worker processes.
+
+        Returns:
+            None once the binary file is written, so the parent can memory-map it. If the binary file cannot be
+            written, the parsed columns and header fields are returned instead.
+        """
+        stock = Stock.ParseCSV(f"Cache/{symbol}.csv")
+        try:
+            stock.SaveToBinary()
+            return None
+        except(OSError):
+            history = stock._history
+            return {'symbol'                 : stock.symbol,
+                    'name'                   : stock.name,
+                    'market'                 : stock.market,
+                    'pe_ratio'               : stock._pe_ratio,
+                    'short_percent_of_float' : stock._short_percent_of_float,
+                    'dates'                  : history.dates,
+                    'prices'                 : history.prices,
+                    'dividends'              : history.dividends,
+                    'annualDividends'        : history.annualDividends}
+
+    @staticmethod
+    @Instrumentation.timed("Stock.LoadMany")
+    def LoadMany(symbols, minDate=None, workers=None, downloadMissing=None, provider=None):
+        """
+        Retrieve many Stocks like ShyRetrieve, parsing cached CSV files in parallel across processes.
+
+        Worker processes convert every cached CSV file without an up to date binary file. The parent process then
+        memory-maps the binary files, so no history is pickled between processes. Symbols which are missing or
+        older than minDate are then downloaded concurrently by a MarketData.RefreshEngine. Without a minDate or
+        downloadMissing, missing symbols are offered for download one at a time as ShyRetrieve does.
+
+        Parameters:
+            symbols ([str]): The symbols to load.
+            minDate (datetime): Downloads fresh data from yfinance if cached data is older than this date.
+            workers (int): Number of worker processes. Defaults to the number of CPUs. 1 parses in this process.
+            downloadMissing (bool): Permission to download all missing Stocks from yfinance.
+            provider (MarketData.Provider): Where to download from. Defaults to the yfinance API.
+
+        Returns:
+            [Stock.LoadResult] in the same order as symbols. Failures are reported in the result instead of raised.
+        """
+        import os
+        import Instrumentation
+        from CacheManifest import CacheManifest
+        from History import History
+        errors   = {}
+        payloads = {}
+        pending  = [symbol for symbol in dict.fromkeys(symbols) if Stock._NeedsConversion(symbol)]
+        Instrumentation.count("CSV files converted", len(pending))
+        if workers == None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and len(pending) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+                futures = {symbol : executor.submit(Stock._ConvertCSV, symbol) for symbol in pending}
+                for symbol, future in futures.items():
+                    try:
+                        payloads[symbol] = future.result()
+                    except Exception as ex:
+                        errors[symbol] = ex
+        else:
+            for symbol in pending:
+                try:
+                    payloads[symbol] = Stock._ConvertCSV(symbol)
+                except Exception as ex:
+                    errors[symbol] = ex
+
+        loaded = {}
+        for symbol in dict.fromkeys(symbols):
+            if symbol in errors:
+                loaded[symbol] = Stock.LoadResult(symbol, error=errors[symbol])
+                continue
+            try:
+                payload = payloads.get(symbol)
+                if payload is not None:
+                    stock = Stock(symbol=payload['symbol'], name=payload['name'], market=payload['market'],
+                                  history=History(payload['dates'], payload['prices'], payload['dividends'], payload['annualDividends']))
+                    stock.pe_ratio = payload['pe_ratio']
+                    stock.short_percent_of_float = payload['short_percent_of_float']
+                else:
+                    stock = Stock._LoadCached(symbol)
+                loaded[symbol] = Stock.LoadResult(symbol, stock=stock)
+            except Exception as ex:
+                loaded[symbol] = Stock.LoadResult(symbol, error=ex)
+
+        # Download whatever is missing or out of date
+        refresh = []
+        for symbol, result in loaded.items():
+            stock = result.stock
+            if result.error is not None or (stock is not None and len(stock.history) != 0 and (minDate == None or stock.history[-1].date >= minDate)):
+                continue
+            if stock is not None and len(stock.history) != 0:
+                refresh.append(stock)
+            elif minDate != None or downloadMissing == True:
+                refresh.append(symbol)
+            elif downloadMissing == False:
+                loaded[symbol] = Stock.LoadResult(symbol, stock=Stock(symbol=symbol))
+            else:
+                try:
+                    loaded[symbol] = Stock.LoadResult(symbol, stock=Stock.ShyRetrieve(symbol, minDate=minDate, downloadMissing=downloadMissing))
+                except Exception as ex:
+                    loaded[symbol] = Stock.LoadResult(symbol, error=ex)
+        if len(refresh) != 0:
+            from MarketData import RefreshEngine
+            Instrumentation.count("symbols refreshed", len(refresh))
+            with Instrumentation.span("Stock.LoadMany refresh"):
+                for stock, result in zip(refresh, RefreshEngine(provider).refresh(refresh)):
+                    loaded[stock if isinstance(stock, str) else stock.symbol] = result
+
+        CacheManifest.Open().save()
+        Instrumentation.sample_memory("Stock.LoadMany")
+        return [loaded[symbol] for symbol in symbols]
+
     @staticmethod
     def ShyRetrieve(symbol, minDate=None, downloadMissing=None):
         """
@@ -452,13 +1491,10 @@ class Stock:
         Returns:
             A Stock pulled from local hard drive if available, pulled from yfinance API otherwise.
         """
-        import os
-        for file in os.listdir("Cache"):
-            if file == f"{symbol}.csv":
-                print(f"Parsing {symbol} from local drive.")
-                stock = Stock.ParseCSV("Cache/" + file)
-                if len(stock.history) != 0 and (minDate == None or stock.history[-1].date >= minDate):
-                    return stock
+        # Even a stale copy is loaded, so only the missing tail of its history needs to be downloaded
+        cached = Stock._LoadCached(symbol)
+        if cached is not None and len(cached.history) != 0 and (minDate == None or cached.history[-1].date >= minDate):
+            return cached
 
         def okayToDownload():
             if minDate != None:
@@ -477,9 +1513,10 @@ class Stock:
 
         if okayToDownload():
             #stock = Stock.FromYfinance(symbol=symbol)
-            stock = Stock(symbol=symbol)
-            stock.Update()
+            stock = cached if cached is not None else Stock(symbol=symbol)
+            stock.Update(incremental=True)
             stock.SaveToCSV()
+            stock.SaveToBinary()
             print(f"{stock.name} downloaded from yfinance API.")
             return stock
         else:
@@ -0,0 +1,303 @@
+class Universe:
+    '''
+    Many Stocks aligned on one calendar: their prices, dividends and annualized dividends as dense date x symbol
+    arrays, so metrics of the whole universe are single array operations instead of loops over Stocks.
+
+    Rows are calendar dates and columns are symbols. The arrays are stored column-major, so the column of one symbol
+    is contiguous, and column() and select() of a run of symbols return views rather than copies.
+
+    Histories whose calendars differ, such as cryptocurrencies (every day) and equities (trading days), are aligned
+    by the fill rules given to FromStocks:
+        prices, annualDividends: On a calendar date without a Snapshot of a symbol, either carry its last known value
+            forward ("ffill"), for at most fill_limit rows if given, or leave NaN ("nan"). Dates before the first
+            Snapshot of a symbol are always NaN.
+        dividends: Never repeated. A dividend paid on a date which is not in the calendar is added to the next
+            calendar date, so the total paid over any range of dates is preserved. Cells without a dividend are 0.
+
+    Members:
+        symbols:         [str] The symbol of each column.
+        dates:           numpy.datetime64[us] array of the calendar, one date per row, at midnight.
+        prices:          2-D array of prices (USD).
+        dividends:       2-D array of the dividends paid (USD).
+        annualDividends: 2-D array of the annualized dividends (USD/year).
+        known:           2-D boolean array marking the cells which hold a Snapshot, rather than a filled value.
+        fill:            The fill rule of prices and annualized dividends, "ffill" or "nan".
+    '''
+
+    import collections
+
+    CALENDARS = ('union', 'intersection')
+    FILLS     = ('ffill', 'nan')
+
+    Column = collections.namedtuple('Column', ['prices', 'dividends', 'annualDividends', 'known'])
+
+    def __init__(self, symbols, dates, prices, dividends, annualDividends, known, fill='ffill'):
+        '''
+        Wrap arrays which are already aligned. Use FromStocks to align the histories of Stocks.
+
+        Parameters:
+            symbols ([str]): The symbol of each column.
+            dates: The calendar, one date per row, in chronological order.
+            prices, dividends, annualDividends, known: 2-D arrays of one row per date and one column per symbol.
+            fill ("ffill" or "nan"): The fill rule the arrays were built with.
+        '''
+        self.symbols         = list(symbols)
+        self.dates           = dates
+        self.prices          = prices
+        self.dividends       = dividends
+        self.annualDividends = annualDividends
+        self.known           = known
+        self.fill            = fill
+        self._columns        = {symbol : index for index, symbol in enumerate(self.symbols)}
+
+    @staticmethod
+    def FromStocks(stocks, calendar='union', fill='ffill', fill_limit=None, dtype='float64', start=None, end=None):
+        '''
+        Align the histories of many Stocks on one calendar.
+
+        Snapshots are aligned by day, so a Snapshot at any time of a day fills the row of that date.
+
+        Parameters:
+            stocks ([Stock]): The Stocks to align, one column each, in this order. Symbols must be unique.
+            calendar ("union", "intersection" or a sequence of dates):
+                "union" has every date on which any of the Stocks has a Snapshot.
+                "intersection" only has the dates on which every Stock has a Snapshot.
+                A sequence of dates is used as given, after sorting.
+            fill ("ffill" or "nan"): How to fill prices and annualized dividends on dates without a Snapshot.
+            fill_limit: The most rows a value is carried forward by "ffill". Defaults to no limit.
+            dtype ("float64" or "float32"): How the values are stored. float32 halves the memory of a large universe,
+                at about 7 significant digits. Metrics are computed in float64 either way.
+            start, end (datetime): Limit the calendar to these dates, inclusive. Values from before start still seed
+                the fill of the first rows.
+
+        Returns:
+            Universe
+        '''
+        import numpy
+        from History import History
+        if fill not in Universe.FILLS:
+            raise ValueError(f"fill must be one of {Universe.FILLS}")
+        symbols = [stock.symbol for stock in stocks]
+        if len(set(symbols)) != len(symbols):
+            raise ValueError("Symbols of a Universe must be unique.")
+        days = [stock.history.dates.astype('datetime64[D]') for stock in stocks]
+
+        if isinstance(calendar, str):
+            if calendar not in Universe.CALENDARS:
+                raise ValueError(f"calendar must be one of {Universe.CALENDARS} or a sequence of dates")
+            if len(days) == 0:
+                calendar = numpy.zeros(0, dtype='datetime64[D]')
+            elif calendar == 'union':
+                calendar = numpy.unique(numpy.concatenate(days))
+            else:
+                calendar = numpy.unique(days[0])
+                for column in days[1:]:
+                    calendar = numpy.intersect1d(calendar, column, assume_unique=True)
+        else:
+            calendar = numpy.unique(History.to_datetime64_array(calendar).astype('datetime64[D]'))
+        if start is not None:
+            calendar = calendar[calendar >= History.to_datetime64(start).astype('datetime64[D]')]
+        if end is not None:
+            calendar = calendar[calendar <= History.to_datetime64(end).astype('datetime64[D]')]
+
+        shape = (len(calendar), len(stocks))
+        prices          = numpy.full(shape, numpy.nan, dtype=dtype, order='F')
+        dividends       = numpy.zeros(shape, dtype=dtype, order='F')
+        annualDividends = numpy.full(shape, numpy.nan, dtype=dtype, order='F')
+        known           = numpy.zeros(shape, dtype=bool, order='F')
+        for column, (stock, day) in enumerate(zip(stocks, days)):
+            history = stock.history
+            rows    = numpy.searchsorted(calendar, day)
+            inside  = rows < len(calendar)
+            exact   = inside.copy()
+            exact[inside] = calendar[rows[inside]] == day[inside]
+            prices[rows[exact], column]          = history.prices[exact]
+            annualDividends[rows[exact], column] = history.annualDividends[exact]
+            known[rows[exact], column]           = True
+            # Dividends of dates missing from the calendar go to the next calendar date
+            paid = inside & (rows > 0) | exact
+            paid &= numpy.isfinite(history.dividends) & (history.dividends != 0.)
+            numpy.add.at(dividends[:, column], rows[paid], history.dividends[paid])
+            if fill == 'ffill' and len(calendar) != 0:
+                # The last Snapshot before the calendar starts seeds the first rows
+                before = int(numpy.searchsorted(day, calendar[0]))
+                if before != 0 and not known[0, column]:
+                    prices[0, column]          = history.prices[before - 1]
+                    annualDividends[0, column] = history.annualDividends[before - 1]
+        if fill == 'ffill':
+            seeded = known.copy(order='F')
+            if len(calendar) != 0:
+                seeded[0] |= ~numpy.isnan(prices[0])
+            Universe._ForwardFill(seeded, fill_limit, prices, annualDividends)
+        return Universe(symbols, calendar.astype(History.DATE_DTYPE), prices, dividends, annualDividends, known, fill)
+
+    @staticmethod
+    def _ForwardFill(seeded, limit, *arrays):
+        '''Carry the seeded cells of each array forward down their columns, in place, for at most limit rows.'''
+        import numpy
+        rows   = numpy.arange(seeded.shape[0])[:, None]
+        source = numpy.maximum.accumulate(numpy.where(seeded, rows, -1), axis=0)
+        usable = source >= 0
+        if limit is not None:
+            usable &= rows - source <= limit
+        source = numpy.where(usable, source, 0)
+        for array in arrays:
+            filled = numpy.take_along_axis(array, source, axis=0)
+            array[...] = numpy.where(usable, filled, numpy.nan)
+
+    def __len__(self):
+        '''The number of dates in the calendar.'''
+        return len(self.dates)
+
+    def __repr__(self):
+        first = str(self.dates[0].astype('datetime64[D]')) if len(self.dates) != 0 else None
+        last  = str(self.dates[-1].astype('datetime64[D]')) if len(self.dates) != 0 else None
+        return f"Universe({len(self.symbols)} symbols x {len(self.dates)} dates, {first} to {last}, {self.prices.dtype})"
+
+    def index(self, symbol):
+        '''The column of a symbol.'''
+        return self._columns[symbol]
+
+    def column(self, symbol):
+        '''
+        The aligned history of one symbol.
+
+        Returns:
+            Universe.Column of 1-D views of the prices, dividends, annualized dividends and known cells of the symbol.
+        '''
+        column = self._columns[symbol]
+        return Universe.Column(self.prices[:, column], self.dividends[:, column], self.annualDividends[:, column],
+                               self.known[:, column])
+
+    def select(self, symbols=None, start=None, end=None):
+        '''
+        A Universe of some of the symbols and dates of this one.
+
+        Parameters:
+            symbols (slice or [str]): The columns to keep. A slice, or symbols which are adjacent and in order here,
+                select views of the arrays. Any other list of symbols copies them. Defaults to every symbol.
+            start, end (datetime): The first and last dates to keep, inclusive. Rows are always selected as views.
+
+        Returns:
+            Universe
+        '''
+        import numpy
+        from History import History
+        first = 0 if start is None else int(numpy.searchsorted(self.dates, History.to_datetime64(start), side='left'))
+        stop  = len(self.dates) if end is None else int(numpy.searchsorted(self.dates, History.to_datetime64(end), side='right'))
+        rows  = slice(first, max(first, stop))
+        if symbols is None:
+            columns = slice(None)
+        elif isinstance(symbols, slice):
+            columns = symbols
+        else:
+            columns = [self._columns[symbol] for symbol in symbols]
+            if len(columns) != 0 and columns == list(range(columns[0], columns[0] + len(columns))):
+                columns = slice(columns[0], columns[0] + len(columns))
+        names = self.symbols[columns] if isinstance(columns, slice) else [self.symbols[column] for column in columns]
+        def take(array):
+            return array[rows, columns] if isinstance(columns, slice) else numpy.asfortranarray(array[rows][:, columns])
+        return Universe(names, self.dates[rows], take(self.prices), take(self.dividends), take(self.annualDividends),
+                        take(self.known), self.fill)
+
+    def window(self, years, as_of=None, days_per_year=365.25, inclusive=False):
+        '''
+        The rows of the calendar within a number of years of a date, selected the same way as by Stock.window.
+
+        Returns:
+            slice of the rows, usable on any of the arrays.
+        '''
+        import datetime
+        import numpy
+        from History import History
+        latest = as_of is None
+        if latest:
+            as_of = datetime.datetime.now()
+        begin = History.to_datetime64(as_of - datetime.timedelta(days=days_per_year*years))
+        start = int(numpy.searchsorted(self.dates, begin, side='left' if inclusive else 'right'))
+        stop  = len(self.dates) if latest else int(numpy.searchsorted(self.dates, History.to_datetime64(as_of), side='right'))
+        return slice(min(start, stop), stop)
+
+    def _FirstAndLast(self, window):
+        '''
+        The first known row of every column within a window, and the last known row of every column. Columns without
+        a known row in the window get their last known row as both.
+
+        Returns:
+            Tuple: (first rows, last rows, boolean array marking the columns with a known row in the window).
+        '''
+        import numpy
+        known  = self.known[window]
+        found  = known.any(axis=0)
+        first  = window.start + (numpy.argmax(known, axis=0) if len(known) != 0 else 0)
+        last   = len(self.dates) - 1 - numpy.argmax(self.known[::-1], axis=0)
+        return numpy.where(found, first, last), last, found
+
+    def growth_apr(self, years=10):
+        '''
+        The growth of every symbol over a period expressed as APR, the same as Stock.GrowthAPR.
+
+        Returns:
+            numpy array of the effective APR of each column in percent. 0 where the period holds fewer than two
+            Snapshots or starts at a zero price.
+        '''
+        import numpy
+        columns = numpy.arange(len(self.symbols))
+        if len(self.dates) == 0:
+            return numpy.zeros(len(columns))
+        first, last, found = self._FirstAndLast(self.window(years))
+        past    = self.prices[first, columns].astype(numpy.float64)
+        latest  = self.prices[last, columns].astype(numpy.float64)
+        n_years = (self.dates[last] - self.dates[first]) // numpy.timedelta64(1, 'D') / 365.25
+        usable  = found & (first < last) & (past != 0.) & (n_years != 0.)
+        growth  = numpy.zeros(len(columns))
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            growth[usable] = 100. * (latest[usable] / past[usable]) ** (1. / n_years[usable]) - 100.
+        return growth
+
+    def dividend_percent(self, years=10):
+        '''
+        The average dividend yield of every symbol over a period, the same as Stock.AverageDividendPercent: the sum
+        of the yields of its Snapshots in the period, over the number of its Snapshots in the period. Filled cells
+        are left out.
+
+        Returns:
+            numpy array of the average yield of each column in percent. 0 where there are no Snapshots.
+        '''
+        import numpy
+        window = self.window(years, days_per_year=365, inclusive=True)
+        known  = self.known[window]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            yields = self.annualDividends[window].astype(numpy.float64) / self.prices[window]
+        total   = numpy.sum(yields, axis=0, where=known & ~numpy.isnan(yields))
+        samples = numpy.count_nonzero(known, axis=0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            average = 100. * total / samples
+        return numpy.where(numpy.isnan(average), 0., average)
+
+    def returns(self):
+        '''
+        The daily total return of every symbol: the change in price plus the dividend paid, over the previous price.
+
+        Returns:
+            2-D float64 array with one row per date after the first. NaN where either price is unknown.
+        '''
+        import numpy
+        prices = self.prices.astype(numpy.float64)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return (prices[1:] + self.dividends[1:]) / prices[:-1] - 1.
+
+    def total_return_series(self, window=None):
+        '''
+        The value of holding one unit of every symbol from the start of a window, with dividends kept as cash, as
+        Stock.total_return_series.
+
+        Parameters:
+            window (slice): The rows to cover, as returned by window(). Defaults to the whole calendar.
+
+        Returns:
+            2-D float64 array with one row per row of the window.
+        '''
+        import numpy
+        window = window or slice(None)
+        return self.prices[window].astype(numpy.float64) + numpy.cumsum(self.dividends[window], axis=0, dtype=numpy.float64)
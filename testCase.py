@@ -11,10 +11,12 @@ def AskMinYield():
     return float(response)
 
 def AskYears():
-    print("How many years worth of data do you want to consider?")
+    print("How many years worth of data do you want to consider? (type \"sweep\" to compare several)")
     response = input()
     if response == "break":
         return "break"
+    elif response == "sweep":
+        return "sweep"
     elif response == "":
         return AskYears()
     if response.replace('.','').isnumeric():
@@ -74,19 +76,23 @@ class Score:
         self.score = score
 
 def TestCaseWithFit():
-    from AprFit import AprFit
+    import Screener
     from winsound import Beep
     
     # Pull the stock data into memory.
     stocks = []
-    for symbol in symbols:
-        stock = Stock.ShyRetrieve(symbol=symbol, minDate=(datetime.datetime.now() - datetime.timedelta(days=5)))
+    for result in Stock.LoadMany(symbols, minDate=(datetime.datetime.now() - datetime.timedelta(days=5))):
+        if result.error is not None:
+            print(f"Failed to load {result.symbol}: {result.error}")
+            continue
+        stock = result.stock
         if len(stock._history) > 0:
             stocks.append(stock)
         else:
             print(f"{stock.symbol} no history")
     
     Beep(300, 500) # Let the user know it's done importing
+    bySymbol = {stock.symbol : stock for stock in stocks}
 
     today = datetime.datetime.now()
 
@@ -95,96 +101,27 @@ def TestCaseWithFit():
         yearsToConsider = AskYears()
         if yearsToConsider == "break":
             break
-        scores = []
+        if yearsToConsider == "sweep":
+            print(Stock.sweep(stocks).to_string())
+            continue
 
-        startDate = today - datetime.timedelta(seconds = 366 * yearsToConsider * 60 * 60 * 24)
+        # Fit every stock in one pass
+        apr_fits = Stock.get_apr_fits(stocks, years=yearsToConsider)
 
-        for stock in stocks:
-            if stock.history[0].date > startDate:
-                continue
-                # Only plot stocks which have enough history.
-
-            try:
-                apr_fit = stock.get_apr_fit(years=yearsToConsider)
-            except Exception as ex:
-                # Looks like I need to do some sanitizing of the data from yFinance. BEP hits a math domain error here and previously gave strange results in other tests.
-                print(f"Failed to fit curve onto data from {stock.symbol}: {ex}")
-                continue
-
-            # Determine how much this stock is currently overvalued/undervalued
-            total_dividends_since_t_0 = 0.
-            index = len(stock.history) - 1
-            while (stock.history[index].date - today).total_seconds() >= apr_fit.t_0 * 31557600.:
-                total_dividends_since_t_0 += stock.history[index].dividend
-                if index == 0:
-                    break
-                index -= 1
-            undervalue = apr_fit.y_0 * (1 + apr_fit.rate) ** (0. - apr_fit.t_0) - (stock.history[-1].price + total_dividends_since_t_0)
-            undervalue /= stock.history[-1].price + total_dividends_since_t_0
-
-            N_STDEVS = 2. # Number of standard deviations to use for fitness
-            if apr_fit.stdev * N_STDEVS > 1.:
-                score = Score(stock, 0.)
-            else:
-                score = Score(stock, (apr_fit.rate + undervalue / 4.) * (1. - N_STDEVS * apr_fit.stdev) + 1. / stock.pe_ratio)
-                # stdev applies as both uncertainty in the fit and as potential loss
-
-            if math.isnan(score.score):
-                print(f"Failed to calculate score for {stock.symbol}")
-                continue
-
-            # Boost the investments we want to bias towards
-            if stock.symbol in boost:
-                score.score *= 1.5
-
-            # Nerf the stocks we don't like
-            if stock.symbol in nerf:
-                score.score *= 0.5
-
-            # Attach metadata to the score so we can print it.
-            score.rate        = 100. * apr_fit.rate
-            score.undervalue  = 100. * undervalue
-            score.uncertainty = 100. * apr_fit.stdev
-            scores.append(score)
-
-        scores.sort(key=lambda x:x.score)
-        scores.reverse()
+        scores, failures = Screener.score(stocks, apr_fits, yearsToConsider, boost=boost, nerf=nerf, today=today)
+        for symbol, reason in failures.items():
+            # Looks like I need to do some sanitizing of the data from yFinance. BEP hits a math domain error here and previously gave strange results in other tests.
+            print(f"{symbol}: {reason}")
 
         # Recommend how much would have been good to allocated to each
-        number_of_recommendations = 0
-        sum = 0
-        for candidate in scores:
-            if math.isnan(candidate.score):
-                continue
-            if candidate.score <= 0.:
-                continue
-            sum += candidate.score
-            if candidate.score / sum < 0.05:
-                sum -= candidate.score
-                break
-            number_of_recommendations += 1
-
-        # Don't recommend >25% in any one asset
-        LIMIT = 0.25
-        if scores[0].score > sum * LIMIT:
-            redistribution = (scores[0].score - sum * LIMIT) / (number_of_recommendations - 1)
-            for score in scores:
-                score.score += redistribution
-            if scores[1].score > sum * LIMIT:
-                redistribution = (scores[1].score - sum * LIMIT) / (number_of_recommendations - 2)
-                for score in scores:
-                    score.score += redistribution
-                scores[1].score = sum * LIMIT
-            scores[0].score = sum * LIMIT
+        recommendations = Screener.allocate(scores)
 
         print("Recommended distribution:")
-        for i in range(number_of_recommendations):
-            stock = scores[i].stock
-            recommended_percent = 100 * scores[i].score / sum
-            print(f"{recommended_percent:.2f}% in {stock.symbol}    Score: {scores[i].score:.2f}    P/E: {stock.pe_ratio:.2f}    <APR>: {scores[i].rate:.2f}    undervalued by {scores[i].undervalue:.2f}%    uncertainty: {scores[i].uncertainty:.2f}%")
+        for recommendation in recommendations:
+            print(f"{recommendation.percent:.2f}% in {recommendation.symbol}    Score: {recommendation.score:.2f}    P/E: {recommendation.pe_ratio:.2f}    <APR>: {recommendation.rate:.2f}    undervalued by {recommendation.undervalue:.2f}%    uncertainty: {recommendation.uncertainty:.2f}%")
 
             if plot:
-                stock.get_apr_fit(years=yearsToConsider, plot=True)
+                bySymbol[recommendation.symbol].get_apr_fit(years=yearsToConsider, plot=True)
 
         Beep(300, 500)
 
@@ -196,10 +133,12 @@ def OriginalTestCase():
 
     # Pull the stock data into memory.
     stocks = []
-    for symbol in symbols:
-        stock = Stock.ShyRetrieve(symbol=symbol, minDate=(datetime.datetime.now() - datetime.timedelta(days=5)))
-        if len(stock._history) > 0:
-            stocks.append(stock)
+    for result in Stock.LoadMany(symbols, minDate=(datetime.datetime.now() - datetime.timedelta(days=5))):
+        if result.error is not None:
+            print(f"Failed to load {result.symbol}: {result.error}")
+            continue
+        if len(result.stock._history) > 0:
+            stocks.append(result.stock)
 
     today = datetime.datetime.now()
 
@@ -265,57 +204,23 @@ def OriginalTestCase():
             scores.append((stock.symbol, score))
 
             if plot:
-                dates = []
-                relGrowth = []
-                divYieldPercent = []
-                latest = stock.history[-1]
-                for snapshot in stock.history:
-                    if snapshot.date < startDate:
-                        continue
-                    if snapshot.price == 0.0:
-                        continue
-                    if (latest.date - snapshot.date).days == 0.0:
-                        continue
-                    annual_growth = 100. * (latest.price / snapshot.price - 1.) * 1.02 ** ((snapshot.date - latest.date).days / 365.25) / \
-                        ((latest.date - snapshot.date).days / 365.25)
-                    if annual_growth > 1. * (latest.date - snapshot.date).days:
-                        annual_growth = 1. * (latest.date - snapshot.date).days
-                    if annual_growth < -1. * (latest.date - snapshot.date).days:
-                        annual_growth = -1. * (latest.date - snapshot.date).days
-                    dates.append(snapshot.date)
-                    relGrowth.append(annual_growth)
-                    divYieldPercent.append(100. * snapshot.annualDividend / snapshot.price)
-                    if relGrowth[-1] > max_growth:
-                        max_growth = relGrowth[-1]
-                    elif relGrowth[-1] < min_growth:
-                        min_growth = relGrowth[-1]
-                    if divYieldPercent[-1] > 100.:
-                        print(f"{dates[-1]}: {stock.symbol} has {divYieldPercent[-1]}% dividend?")
-                        print("You may not want to trust this data...")
-                    if divYieldPercent[-1] > max_dividend:
-                        max_dividend = divYieldPercent[-1]
-                    elif divYieldPercent[-1] < min_dividend:
-                        min_dividend = divYieldPercent[-1]
+                dates, relGrowth, divYieldPercent = stock.growth_and_dividend_series(start=startDate)
+                if len(dates) != 0:
+                    max_growth   = max(max_growth, float(relGrowth.max()))
+                    min_growth   = min(min_growth, float(relGrowth.min()))
+                    max_dividend = max(max_dividend, float(divYieldPercent.max()))
+                    min_dividend = min(min_dividend, float(divYieldPercent.min()))
+                for date, percent in zip(dates[divYieldPercent > 100.], divYieldPercent[divYieldPercent > 100.]):
+                    print(f"{date.item()}: {stock.symbol} has {percent}% dividend?")
+                    print("You may not want to trust this data...")
 
                 dividend_plot.plot(dates, divYieldPercent, label=stock.symbol)
                 #growth_plot.plot(dates, relGrowth, label=stock.symbol)
 
-            annualYield = []
-            yDates      = []
-            for index in range(200, len(stock.history)):
-                snapshot = stock.history[index]
-                if snapshot.date < startDate:
-                    continue
-                priceLastYear = stock.history[index - 200].price
-                if priceLastYear == 0.0:
-                    continue
-                yDates.append(snapshot.date)
-                annualYield.append(100. * ((snapshot.price - priceLastYear) + snapshot.annualDividend) / priceLastYear)
-                if annualYield[-1] > max_total:
-                    max_total = annualYield[-1]
-                elif annualYield[-1] < min_total:
-                    min_total = annualYield[-1]
-            if plot:
+                yDates, annualYield = stock.rolling_total_yield(200, start=startDate)
+                if len(annualYield) != 0:
+                    max_total = max(max_total, float(annualYield.max()))
+                    min_total = min(min_total, float(annualYield.min()))
                 total_yield_plot.plot(yDates, annualYield, label=stock.symbol)
                 
         annual_yields.sort(key=lambda x:x[1])
@@ -368,4 +273,6 @@ def OriginalTestCase():
             plt.show()
 
 if __name__ == "__main__":
+    # Reuse fits saved by earlier sessions
+    Stock.PERSIST_ANALYTICS = True
     TestCaseWithFit()
\ No newline at end of file